@@ -0,0 +1 @@
+from matp.frame import read_lid
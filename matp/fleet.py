@@ -0,0 +1,179 @@
+'''Convert many lid files into one csv per sensor, merged by time.
+
+Every file is decoded page by page with the same page decoder as parse_file
+and its rows are merged with the rows of the other files as they come (a
+k-way merge), so memory is bounded by a couple of decoded pages per file no
+matter how long the deployments were. Rows get a Logger column after the
+time saying which file they came from.
+'''
+from __future__ import division
+import collections
+import heapq
+import os
+import threading
+
+from matp import mat
+
+LOGGER_COLUMN = 'Logger'
+
+DATE_TIME_HEADER = 'Date,Time'
+# Rows start with a fixed width Date,Time, so they sort by time as text
+TIMESTAMP_LENGTH = len('2013-11-15,09:04:12.0000')
+
+# Pages of each file being decoded ahead of the merge
+DEFAULT_QUEUE_DEPTH = 2
+
+# Number of page decoders each process keeps around, more while merging more
+# files than this. The lookup tables of a decoder stay alive with it, so this
+# bounds memory in a long running process.
+DECODER_CACHE_SIZE = 32
+
+# Page decoders of the files this process decodes pages of, most recently used last
+_page_decoders = collections.OrderedDict()
+_page_decoders_lock = threading.Lock()
+_decoder_cache_size = DECODER_CACHE_SIZE
+
+def set_decoder_cache_size(size):
+    '''Keep the page decoders of at least size files in this process, returns the size before
+
+    A merge takes a page of every file in turn, with fewer decoders than files
+    each one would be rebuilt for every page. Also the initializer of the
+    merge pool.
+    '''
+    global _decoder_cache_size
+    with _page_decoders_lock:
+        previous = _decoder_cache_size
+        _decoder_cache_size = max(size, DECODER_CACHE_SIZE)
+        while len(_page_decoders) > _decoder_cache_size:
+            _page_decoders.popitem(last=False)
+    return previous
+
+def logger_id(lid_filename, header):
+    '''Return the serial number of the logger, the file name without extension if there is none'''
+    serial = header.get('SER', '').strip()
+    if serial:
+        return serial
+    return os.path.splitext(os.path.basename(lid_filename))[0]
+
+def decode_file_page(lid_filename, page_number, only=None, default_host_storage=False):
+    '''Return the (orientation, temperature) text of a data page of a lid file
+
+    The page is read here so that only its name and number have to be sent
+    to a worker process. Each process builds the decoder of a file once, and
+    again if the file is changed.
+    '''
+    with open(lid_filename, 'rb') as lid:
+        key = (lid_filename, os.fstat(lid.fileno()).st_mtime, only, default_host_storage)
+        with _page_decoders_lock:
+            if key in _page_decoders:
+                _page_decoders.move_to_end(key)
+            else:
+                header, mini_header, hss, mh_size = mat.parse_main_header(
+                    lid.read(mat.MAIN_HEADER_SIZE))
+                if default_host_storage:
+                    hss = mat.DEFAULT_HOST_STORAGE
+                _page_decoders[key] = mat.get_page_decoder(mini_header, hss, mh_size, only=only)
+                while len(_page_decoders) > _decoder_cache_size:
+                    _page_decoders.popitem(last=False)
+            decode_page = _page_decoders[key]
+        lid.seek(mat.MAIN_HEADER_SIZE + mat.DATA_PAGE_SIZE * page_number, os.SEEK_SET)
+        return decode_page(lid.read(mat.DATA_PAGE_SIZE))
+
+def decode_file(lid_filename, only=None, default_host_storage=False, pool=None,
+                queue_depth=DEFAULT_QUEUE_DEPTH):
+    '''Yield the (orientation, temperature) text of every data page of the file, in order
+
+    With a pool, the next queue_depth pages are decoded while the caller is
+    busy with this one.
+    '''
+    args = (only, default_host_storage)
+    pending = collections.deque()
+    page_numbers = iter(range(mat.count_data_pages(lid_filename)))
+    while True:
+        if pool is not None:
+            for page_number in page_numbers:
+                pending.append(pool.apply_async(decode_file_page,
+                                                (lid_filename, page_number) + args))
+                if len(pending) >= queue_depth:
+                    break
+            if not pending:
+                return
+            decoded = pending.popleft().get()
+        else:
+            page_number = next(page_numbers, None)
+            if page_number is None:
+                return
+            decoded = decode_file_page(lid_filename, page_number, *args)
+        yield decoded
+
+def _file_rows(lid_filename, logger, only, default_host_storage, pool, queue_depth):
+    '''Yield the csv rows of the file with its logger id after the time'''
+    text = 1 if only == 'temp' else 0
+    for decoded in decode_file(lid_filename, only=only, default_host_storage=default_host_storage,
+                               pool=pool, queue_depth=queue_depth):
+        for row in decoded[text].splitlines(True):
+            yield row[:TIMESTAMP_LENGTH] + ',' + logger + row[TIMESTAMP_LENGTH:]
+
+def merge_files(lid_filenames, fh, only='temp', default_host_storage=False, workers=0,
+                queue_depth=DEFAULT_QUEUE_DEPTH):
+    '''Write the temperature (only='temp') or orientation (only='ori') csv of all files, merged by time
+
+    Rows with the same time keep the order of lid_filenames. All files need
+    the same columns. With workers > 0 the pages are decoded in a pool of that
+    many processes, queue_depth pages per file at a time.
+    '''
+    sources = []
+    headers = set()
+    for lid_filename in lid_filenames:
+        with open(lid_filename, 'rb') as lid:
+            header, mini_header, hss, mh_size = mat.parse_main_header(lid.read(mat.MAIN_HEADER_SIZE))
+        selected = mat.select_sensors(mini_header, only)
+        if only == 'temp':
+            headers.add(mat.get_tmp_csv_headers(temp=selected['TMP']))
+        else:
+            headers.add(mat.get_ori_csv_headers(accel=selected['ACL'], magne=selected['MGN']))
+        sources.append((lid_filename, logger_id(lid_filename, header)))
+    if not headers:
+        raise ValueError('No lid files to merge')
+    if len(headers) > 1:
+        raise ValueError('Can not merge files with different columns: %s'
+                         % ' and '.join(sorted(h.strip() for h in headers)))
+    csv_header = headers.pop()
+
+    # One decoder per file for the whole merge, in every process decoding pages
+    pool = None
+    previous_cache_size = None
+    if workers > 0:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers, initializer=set_decoder_cache_size,
+                                    initargs=(len(sources),))
+    else:
+        previous_cache_size = set_decoder_cache_size(len(sources))
+    try:
+        fh.write(DATE_TIME_HEADER + ',' + LOGGER_COLUMN + csv_header[len(DATE_TIME_HEADER):])
+        rows = [_file_rows(lid_filename, logger, only, default_host_storage, pool, queue_depth)
+                for lid_filename, logger in sources]
+        for row in heapq.merge(*rows, key=lambda row: row[:TIMESTAMP_LENGTH]):
+            fh.write(row)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if previous_cache_size is not None:
+            set_decoder_cache_size(previous_cache_size)
+
+def export_fleet(lid_filenames, ori_fh, temp_fh, default_host_storage=False, workers=0,
+                 queue_depth=DEFAULT_QUEUE_DEPTH, only=None):
+    '''Write the orientation and temperature csv of all files, each merged by time
+
+    The two csv files are merged one after the other, each pass only decodes
+    its own readings. With only='temp' or only='ori' the other csv just gets
+    Date,Time,Logger as its header, like parse_file.
+    '''
+    kwargs = dict(default_host_storage=default_host_storage, workers=workers,
+                  queue_depth=queue_depth)
+    for sensors, fh in (('temp', temp_fh), ('ori', ori_fh)):
+        if only in (None, sensors):
+            merge_files(lid_filenames, fh, only=sensors, **kwargs)
+        else:
+            fh.write(DATE_TIME_HEADER + ',' + LOGGER_COLUMN + os.linesep)
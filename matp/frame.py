@@ -0,0 +1,194 @@
+'''Read lid files into pandas DataFrames.
+
+The sensor columns are calibrated straight from the readings of each data
+page with numpy, nothing is formatted as text on the way. numpy and pandas
+are only imported once a file is read.
+'''
+from __future__ import division
+import os
+
+from matp import mat
+
+TIME_INDEX = 'Time'
+
+def available_columns(mini_header):
+    '''Return the sensor columns of a file with the given mini header, in csv order'''
+    columns = []
+    if mini_header['TMP'] == '1':
+        columns.append(mat.TEMPERATURE_COLUMN)
+    if mini_header['ACL'] == '1':
+        columns.extend(mat.ACCELEROMETER_COLUMNS)
+    if mini_header['MGN'] == '1':
+        columns.extend(mat.MAGNETOMETER_COLUMNS)
+    return columns
+
+def _calibrations(np, hss, columns):
+    '''Return {column: function from raw readings to float32 values} for the columns'''
+    calibrations = {}
+    if mat.TEMPERATURE_COLUMN in columns:
+        temps = np.empty(mat.MAX_UNSIGNED_SHORT + 1)
+        temps[:-1] = list(mat.thermometer_values(hss['TMA'], hss['TMB'], hss['TMC'],
+                                                 hss['TMO'], hss['TMR']))
+        # Neither 0 nor 0xFFFF come from the thermometer
+        temps[0] = temps[-1] = np.nan
+        temps = temps.astype(np.float32)
+        calibrations[mat.TEMPERATURE_COLUMN] = lambda raw: temps[raw]
+    # Calibrated like the orientation csv
+    scale = 1 / hss['AXB']
+    for column in mat.ACCELEROMETER_COLUMNS:
+        calibrations[column] = lambda raw: (scale * raw + hss['AXA']).astype(np.float32)
+    for column in mat.MAGNETOMETER_COLUMNS:
+        calibrations[column] = lambda raw: (hss['MXS'] * raw + hss['MXA']).astype(np.float32)
+    return calibrations
+
+def get_page_array_reader(np, mini_header, mh_size, columns):
+    '''Return a function that unpacks a raw data page into numpy arrays
+
+    read_page(data_page) returns (tmp_times, tmp_raw, ori_times, ori_raw):
+    datetime64[ns] arrays of reading times, the uint16 temperature readings,
+    and {column: int16 readings} for the requested orientation columns.
+    Only the requested sensors are gathered from the page.
+    '''
+    layout = mat.get_page_layout(mini_header)
+    tmp_positions, ori_start, ori_stop = mat.pattern_word_positions(layout)
+    pattern_words = layout.p_size // 2
+    rows_per_pattern = (ori_stop - ori_start) // 6
+    ori_ns = np.timedelta64(layout.ori_delta, 'ns')
+    tmp_ns = np.timedelta64(layout.tmp_delta, 'ns')
+    burst_ns = np.timedelta64(layout.burst_delta, 'ns')
+    want_tmp = layout.tmp and mat.TEMPERATURE_COLUMN in columns
+    ori_axes = [(column, axis)
+                for axis, column in enumerate(mat.ACCELEROMETER_COLUMNS + mat.MAGNETOMETER_COLUMNS)
+                if column in columns]
+
+    def read_page(data_page):
+        clk = np.datetime64(mat.page_clock(data_page, mh_size), 'ns')
+        data = memoryview(data_page)[mh_size:]
+        full = len(data) // layout.p_size
+        words = np.frombuffer(data, dtype='<i2', count=full * pattern_words)
+        words = words.reshape(full, pattern_words)
+        # The last pattern of a page is usually cut short, unpack it like the csv does
+        tail = []
+        if len(data) % layout.p_size:
+            tail = list(mat.unpack_patterns(data[full * layout.p_size:], patterns_in_page=1,
+                                            p=layout.p, p_size=layout.p_size, bmn=layout.bmn,
+                                            tri=layout.tri, ori=layout.ori))
+        pattern_starts = clk + np.arange(full + len(tail)) * ori_ns
+
+        tmp_times = tmp_raw = None
+        if want_tmp:
+            tmp_raw = words.view('<u2')[:, tmp_positions].ravel()
+            tmp_times = (pattern_starts[:full, None]
+                         + np.arange(len(tmp_positions)) * tmp_ns).ravel()
+            for t_data, o_data in tail:
+                tmp_raw = np.concatenate([tmp_raw, np.array(t_data, dtype='<u2')])
+                tmp_times = np.concatenate([tmp_times,
+                                            pattern_starts[full] + np.arange(len(t_data)) * tmp_ns])
+
+        ori_times = None
+        ori_raw = {}
+        if ori_axes:
+            ori = words[:, ori_start:ori_start + rows_per_pattern * 6]
+            ori = ori.reshape(full, rows_per_pattern, 6)
+            ori_times = (pattern_starts[:full, None]
+                         + np.arange(rows_per_pattern) * burst_ns).ravel()
+            for column, axis in ori_axes:
+                ori_raw[column] = ori[:, :, axis].ravel()
+            for t_data, o_data in tail:
+                rows = len(o_data) // 6
+                o_data = np.array(o_data[:rows * 6], dtype='<i4').reshape(rows, 6)
+                ori_times = np.concatenate([ori_times,
+                                            pattern_starts[full] + np.arange(rows) * burst_ns])
+                for column, axis in ori_axes:
+                    ori_raw[column] = np.concatenate([ori_raw[column], o_data[:, axis]])
+        return tmp_times, tmp_raw, ori_times, ori_raw
+
+    return read_page
+
+def _build_frame(np, pd, pages, columns, calibrations):
+    '''Return one DataFrame out of the arrays of several pages'''
+    frames = []
+    if mat.TEMPERATURE_COLUMN in columns:
+        times = np.concatenate([page[0] for page in pages] or [np.array([], 'datetime64[ns]')])
+        raw = np.concatenate([page[1] for page in pages] or [np.array([], '<u2')])
+        frames.append(pd.DataFrame({mat.TEMPERATURE_COLUMN: calibrations[mat.TEMPERATURE_COLUMN](raw)},
+                                   index=pd.DatetimeIndex(times, name=TIME_INDEX)))
+    ori_columns = [column for column in columns if column != mat.TEMPERATURE_COLUMN]
+    if ori_columns:
+        times = np.concatenate([page[2] for page in pages] or [np.array([], 'datetime64[ns]')])
+        data = {}
+        for column in ori_columns:
+            raw = np.concatenate([page[3][column] for page in pages] or [np.array([], '<i2')])
+            data[column] = calibrations[column](raw)
+        frames.append(pd.DataFrame(data, columns=ori_columns,
+                                   index=pd.DatetimeIndex(times, name=TIME_INDEX)))
+    if len(frames) == 1:
+        return frames[0]
+    # Temperature and orientation rows are stacked rather than joined on their times, a
+    # join multiplies the rows of a time that is there more than once
+    return pd.concat(frames).sort_index(kind='stable')
+
+def _iter_pages(lid, num_pages, mh_size, start=None, end=None):
+    '''Yield the data pages that can have readings between start and end'''
+    for page_number in range(num_pages):
+        if start is not None and page_number + 1 < num_pages:
+            # Pages go forward in time, skip this one if the next one starts before start
+            lid.seek(mat.MAIN_HEADER_SIZE + mat.DATA_PAGE_SIZE * (page_number + 1), os.SEEK_SET)
+            if mat.page_clock(lid.read(mh_size), mh_size) <= start:
+                continue
+        lid.seek(mat.MAIN_HEADER_SIZE + mat.DATA_PAGE_SIZE * page_number, os.SEEK_SET)
+        data_page = lid.read(mat.DATA_PAGE_SIZE)
+        if end is not None and mat.page_clock(data_page, mh_size) > end:
+            return
+        yield data_page
+
+def _iter_frames(path, chunksize, columns, start, end, default_host_storage):
+    import numpy as np
+    import pandas as pd
+
+    num_pages = mat.count_data_pages(path)
+    with open(path, 'rb') as lid:
+        header, mini_header, hss, mh_size = mat.parse_main_header(lid.read(mat.MAIN_HEADER_SIZE))
+        if default_host_storage:
+            hss = mat.DEFAULT_HOST_STORAGE
+        available = available_columns(mini_header)
+        if columns is None:
+            columns = available
+        missing = [column for column in columns if column not in available]
+        if missing:
+            raise ValueError('%s has no %s column, it has %s'
+                             % (path, ', '.join(missing), ', '.join(available)))
+        columns = [column for column in available if column in columns]
+        calibrations = _calibrations(np, hss, columns)
+        read_page = get_page_array_reader(np, mini_header, mh_size, columns)
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+
+        pages = []
+        for data_page in _iter_pages(lid, num_pages, mh_size, start=start, end=end):
+            pages.append(read_page(data_page))
+            if chunksize is not None and len(pages) == chunksize:
+                yield _build_frame(np, pd, pages, columns, calibrations).loc[start:end]
+                pages = []
+        if pages or chunksize is None:
+            yield _build_frame(np, pd, pages, columns, calibrations).loc[start:end]
+
+def read_lid(path, chunksize=None, columns=None, start=None, end=None,
+             default_host_storage=False):
+    '''Read a lid file into a pandas DataFrame
+
+    The DataFrame has a DatetimeIndex and a float32 column per sensor, named
+    like the csv columns (see available_columns). Temperature and orientation
+    readings are separate rows in time order, temperature first when they have
+    the same time, a row with one has NaN for the others.
+    Temperature readings of 0 and 0xFFFF are not valid and read as NaN.
+
+    chunksize -- return an iterator of DataFrames of this many data pages each
+    columns -- only read these columns, the other sensors are not decoded
+    start, end -- only return readings from start up to and including end,
+                  data pages outside of them are not decoded
+    '''
+    frames = _iter_frames(path, chunksize, columns, start, end, default_host_storage)
+    if chunksize is None:
+        return next(frames)
+    return frames
@@ -4,7 +4,10 @@ import math
 import os
 import datetime
 import sys
-from cStringIO import StringIO
+import threading
+import collections
+import re
+from queue import Queue, Empty, Full
 
 DEBUG=os.getenv('DEBUG', False)
 
@@ -35,9 +38,13 @@ DEFAULT_HOST_STORAGE = {
     'TMC': 0.0000000848361,
 }
 
-HEADER_SEPARATOR = '\x0d\x0a'
+HEADER_SEPARATOR = b'\x0d\x0a'
+# Headers are ASCII, latin-1 turns any byte into a character so garbage never raises
+HEADER_ENCODING = 'latin-1'
 
 ISO_SEPARATOR = ','
+# Decoded rows are ASCII bytes until the whole page is done
+LINE_SEPARATOR = os.linesep.encode('ascii')
 CLOCK_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 TRUNCATE_MICROSECOND_DIGITS = -2
@@ -48,26 +55,59 @@ DATA_PAGE_SIZE = 1024 * K
 # Length of header tags
 TAG_LEN = 3
 
+# Number of calibrations whose lookup tables are kept around
+LOOKUP_TABLE_CACHE_SIZE = 8
+
+# Number of pages allowed to wait between two stages of the pipeline
+DEFAULT_QUEUE_DEPTH = 4
+# How long a blocked pipeline stage waits before checking if it should stop
+QUEUE_POLL_SECONDS = 0.1
+
 def k_to_c(kelvin):
     '''Kelvin to celcius'''
     return kelvin - 273.15
 
+def scan_header(header_bytes, start=0, end=None, sep=HEADER_SEPARATOR):
+    '''Yield (line_start, line_end, space) of every line between start and end
+
+    The lines are found in one pass over the bytes, nothing is copied. space
+    is the offset of the first space in the line, -1 if there is none.
+    '''
+    if end is None:
+        end = len(header_bytes)
+    find = header_bytes.find
+    while start < end:
+        line_end = find(sep, start, end)
+        if line_end == -1:
+            line_end = end
+        yield start, line_end, find(b' ', start, line_end)
+        start = line_end + len(sep)
+
+def _tag_values(header_bytes, sep=HEADER_SEPARATOR):
+    '''Yield (tag, value) as str for every "TAG value" line'''
+    for line_start, line_end, space in scan_header(header_bytes, sep=sep):
+        if space != -1:
+            yield (header_bytes[line_start:space].decode(HEADER_ENCODING),
+                   header_bytes[space+1:line_end].decode(HEADER_ENCODING))
+
 def parse_header(header_bytes, sep=HEADER_SEPARATOR):
-    '''Return the given bytes as a dictionary'''
-    kvpairs = header_bytes.split(sep)
-    return dict((str(kv).split(' ', 1) for kv in kvpairs if ' ' in kv))
+    '''Return the given bytes as a dictionary of str'''
+    return dict(_tag_values(bytes(header_bytes), sep=sep))
 
 def mh_indicies(header_bytes):
     '''Get where the mini header starts and stops inside the main header'''
-    start = header_bytes.rfind('MHS')
-    end = header_bytes.rfind('MHE') + 5 # +5 for MHE\x0d\x0a
+    start = header_bytes.rfind(b'MHS')
+    end = header_bytes.rfind(b'MHE') + 5 # +5 for MHE\x0d\x0a
     return start, end
 
 def clean_hss(hss_bytes):
-    '''Return the hss bytes between HSS and HSE'''
-    start = hss_bytes.find('HSS')
-    end = hss_bytes.rfind('HSE') + 3
-    return str(hss_bytes[start:end])
+    '''Return the hss between HSS and HSE as str'''
+    start = hss_bytes.find(b'HSS')
+    end = hss_bytes.rfind(b'HSE') + 3
+    return bytes(hss_bytes[start:end]).decode(HEADER_ENCODING)
+
+HSS_INT_TAGS = ('AXA', 'AXB', 'AYA', 'AYB', 'AZA', 'AZB', 'MXA', 'MYA', 'MZA', 'TMR', 'TMO')
+HSS_FLOAT_TAGS = ('MXS', 'MYS', 'MZS', 'TMA', 'TMB', 'TMC')
 
 def parse_hss(hss_bytes):
     '''If there is no HSS tag use the default, otherwise parse the HSS and return it
@@ -75,62 +115,132 @@ def parse_hss(hss_bytes):
     This parses strings like this: "ABC13CDE41234"
     Into this: {'ABC': 3, 'CDE': 1234}
     '''
-    if hss_bytes.find('HSS') == -1:
+    if hss_bytes.find(b'HSS') == -1:
         return DEFAULT_HOST_STORAGE
-    hss_bytes = clean_hss(hss_bytes)
+    hss_text = clean_hss(hss_bytes)
     hss = {}
-    offset = 0
+    # Each value is read by its offset in the text, tag and length come before it
+    offset = len('HSS')
     while True:
-        tag = hss_bytes[offset:offset+TAG_LEN]
-        if tag == 'HSS':
-            offset += 3
-            continue
+        tag = hss_text[offset:offset+TAG_LEN]
         if tag == 'HSE':
             break
-        length = int(hss_bytes[offset+TAG_LEN:offset+TAG_LEN+1], 16)
-        val = hss_bytes[offset+TAG_LEN+1:offset+TAG_LEN+1+length]
-        offset += 4 + length
-        hss[tag] = val
-    int_tags = ['AXA','AXB', 'AYA', 'AYB', 'AZA', 'AZB', 'MXA', 'MYA', 'MZA', 'TMR', 'TMO',]
-    float_tags = ['MXS', 'MYS', 'MZS', 'TMA', 'TMB', 'TMC',]
-    for tag in int_tags:
-        if tag in hss:
-            hss[tag] = int(hss[tag])
-    for tag in float_tags:
-        if tag in hss:
-            hss[tag] = float(hss[tag])
-
+        start = offset + TAG_LEN + 1
+        offset = start + int(hss_text[start-1:start], 16)
+        if tag in HSS_INT_TAGS:
+            hss[tag] = int(hss_text[start:offset])
+        elif tag in HSS_FLOAT_TAGS:
+            hss[tag] = float(hss_text[start:offset])
+        else:
+            hss[tag] = hss_text[start:offset]
     return hss
 
 def parse_main_header(header_bytes):
     '''Return three dictionaries and a value.
 
+    The header and mini header are read in one pass over the lines of the
+    main header, up to the HSS.
+
     Returns:
         header -- dict of values found in the main header
         mini_header -- dict of values found in the mini header in the main header
         hss -- dict of values for the host storage
         mini_header_size -- int the number of bytes the miniheader takes up
     '''
-    hss_start = header_bytes.rfind('HSS')
-    mh_start, mh_end = mh_indicies(header_bytes)
-    mini_header = parse_header(header_bytes[mh_start:mh_end])
-    header = parse_header(header_bytes[:mh_start] + header_bytes[mh_end:hss_start])
-    hss = parse_hss(header_bytes[hss_start:])
+    header_bytes = bytes(header_bytes)
+    header = {}
+    mini_header = {}
+    values = header
+    mh_start = mh_end = hss_start = -1
+    for line_start, line_end, space in scan_header(header_bytes):
+        if header_bytes.startswith(b'HSS', line_start):
+            hss_start = line_start
+            break
+        if space != -1:
+            values[header_bytes[line_start:space].decode(HEADER_ENCODING)] = \
+                header_bytes[space+1:line_end].decode(HEADER_ENCODING)
+        elif line_end - line_start == TAG_LEN:
+            if header_bytes.startswith(b'MHS', line_start):
+                mh_start = line_start
+                values = mini_header
+            elif header_bytes.startswith(b'MHE', line_start):
+                mh_end = line_end + len(HEADER_SEPARATOR)
+                values = header
+    if mh_start == -1 or mh_end == -1:
+        # Not laid out line by line, find the mini header wherever it is
+        mh_start, mh_end = mh_indicies(header_bytes)
+        mini_header = parse_header(header_bytes[mh_start:mh_end])
+    if hss_start == -1:
+        hss_start = header_bytes.rfind(b'HSS')
+    # Only the block up to the first HSE, the rest of the main header is padding
+    hss_end = header_bytes.find(b'HSE', hss_start)
+    hss = parse_hss(header_bytes[hss_start:hss_end + len(b'HSE') if hss_end != -1 else None])
     return header, mini_header, hss, mh_end - mh_start
 
+class LookupTable(object):
+    '''Preformatted strings for every possible reading, packed into one buffer
+
+    A dict of 65536 str objects costs several MB per table per process, this
+    costs one byte per character. Every value is right justified to the same
+    width so the value for reading r is found at
+    buffer[(r - first) * width:(r - first + 1) * width]. The buffer is ASCII
+    bytes, the padding is spaces, the page decoder strips them from a whole
+    page at once.
+    '''
+    def __init__(self, values, first=0):
+        values = list(values)
+        self.first = first
+        self.width = max(len(v) for v in values)
+        self.buffer = ''.join(v.rjust(self.width) for v in values).encode('ascii')
+
+    @classmethod
+    def formatted(cls, numbers, number_format, first=0):
+        '''Return the table of number_format % n for every number
+
+        The whole buffer is formatted in one operation, which is several times
+        quicker than formatting and padding every value on its own.
+        '''
+        numbers = tuple(numbers)
+        table = cls.__new__(cls)
+        table.first = first
+        # The longest value is the one of the smallest or the largest number
+        table.width = max(len(number_format % n) for n in (min(numbers), max(numbers)))
+        padded = '%' + str(table.width) + number_format[1:]
+        table.buffer = (padded * len(numbers) % numbers).encode('ascii')
+        return table
+
+    def __len__(self):
+        return len(self.buffer) // self.width
+
+    def __getitem__(self, reading):
+        start = (reading - self.first) * self.width
+        if not 0 <= start < len(self.buffer):
+            raise IndexError(reading)
+        return self.buffer[start:start + self.width].decode('ascii').lstrip()
+
+    def share(self):
+        '''Return this table with its buffer in shared memory.
+
+        Worker processes given the shared table as a Pool initarg all read the
+        same memory instead of each getting a copy.
+        '''
+        import multiprocessing
+        shared = LookupTable.__new__(LookupTable)
+        shared.first = self.first
+        shared.width = self.width
+        shared.buffer = multiprocessing.RawArray('c', len(self.buffer))
+        shared.buffer[:] = self.buffer
+        return shared
+
 def build_accelerometer_values(a, b):
     '''Build a lookup table for all possible accelerometer values'''
-    values = (1/b * f + a for f in xrange(SHORT_SIGNED_MIN, SHORT_SIGNED_MAX))
-    return {i: '%.5f' % acc 
-            for i, acc in enumerate(values, start=SHORT_SIGNED_MIN)
-    }
+    values = (1/b * f + a for f in range(SHORT_SIGNED_MIN, SHORT_SIGNED_MAX))
+    return LookupTable.formatted(values, '%.5f', first=SHORT_SIGNED_MIN)
 
 def build_magnetometer_values(a, s):
     '''build a lookup table for all possible magnetometer values'''
-    values = (s * x + a for x in xrange(SHORT_SIGNED_MIN, SHORT_SIGNED_MAX))
-    return {i: '%.2f' % mag
-            for i, mag in enumerate(values, start=SHORT_SIGNED_MIN)
-    }
+    values = (s * x + a for x in range(SHORT_SIGNED_MIN, SHORT_SIGNED_MAX))
+    return LookupTable.formatted(values, '%.2f', first=SHORT_SIGNED_MIN)
 
 def t_measure_to_resistance(t, tmo, tmr):
     '''Given a measurement from the device turn it into a resistance measurement'''
@@ -149,23 +259,93 @@ def temp(num, tma, tmb, tmc, tmo, tmr):
         return 0
     return s(t_measure_to_resistance(num, tmo, tmr), tma, tmb, tmc)
 
+def thermometer_values(tma, tmb, tmc, tmo, tmr):
+    '''Yield the celcius value of every possible thermometer reading, starting at 0'''
+    log = math.log
+    # This is temp() inlined, calling it 65535 times is most of the build time
+    yield temp(0, tma, tmb, tmc, tmo, tmr)
+    for x in range(1, 65535):
+        r_adj = x + tmo
+        l = log(tmr * r_adj / (MAX_UNSIGNED_SHORT - r_adj))
+        # ** and / round the same as math.pow here
+        yield 1 / (tma + tmb * l + tmc * l ** 3) - 273.15
+
 def build_thermometer_values(tma, tmb, tmc, tmo, tmr):
     '''build a lookup table for all possible thermometer values'''
-    return ['%.4f' % temp(x, tma, tmb, tmc, tmo, tmr) for x in xrange(0, 65535)]
-
-def get_lookup_tables(axa, axb, mxa, mxs, tma, tmb, tmc, tmo, tmr):
-    accelerometer_values = build_accelerometer_values(axa, axb)
-    magnetometer_values = build_magnetometer_values(mxa, mxs)
-    # This is a straight array lookup
-    thermometer_values = build_thermometer_values(tma, tmb, tmc, tmo, tmr)
+    return LookupTable.formatted(thermometer_values(tma, tmb, tmc, tmo, tmr), '%.4f')
+
+_lookup_table_cache = collections.OrderedDict()
+# Decoders can be built from several threads at once (see matp.server)
+_lookup_table_cache_lock = threading.Lock()
+
+def _cached_table(build, *args):
+    '''Return build(*args), reusing the table from an earlier call with the same args'''
+    key = (build.__name__,) + args
+    with _lookup_table_cache_lock:
+        if key in _lookup_table_cache:
+            table = _lookup_table_cache.pop(key)
+        else:
+            table = build(*args)
+        _lookup_table_cache[key] = table
+        while len(_lookup_table_cache) > LOOKUP_TABLE_CACHE_SIZE * 3:
+            _lookup_table_cache.popitem(last=False)
+    return table
+
+def get_lookup_tables(axa, axb, mxa, mxs, tma, tmb, tmc, tmo, tmr, acl=True, mgn=True, tmp=True):
+    '''Return the (accelerometer, magnetometer, thermometer) lookup tables
+
+    Only the tables of the enabled sensors are built, the others are None.
+    Tables are cached by their calibration values.
+    '''
+    accelerometer_values = magnetometer_values = thermometer_values = None
+    if acl:
+        accelerometer_values = _cached_table(build_accelerometer_values, axa, axb)
+    if mgn:
+        magnetometer_values = _cached_table(build_magnetometer_values, mxa, mxs)
+    if tmp:
+        # This is a straight array lookup
+        thermometer_values = _cached_table(build_thermometer_values, tma, tmb, tmc, tmo, tmr)
     return accelerometer_values, magnetometer_values, thermometer_values
 
+def get_sensor_lookup_tables(mini_header, hss):
+    '''Return the lookup tables for the sensors enabled in the mini header'''
+    return get_lookup_tables(hss['AXA'], hss['AXB'], hss['MXA'], hss['MXS'],
+                             hss['TMA'], hss['TMB'], hss['TMC'], hss['TMO'], hss['TMR'],
+                             acl=mini_header['ACL'] == '1',
+                             mgn=mini_header['MGN'] == '1',
+                             tmp=mini_header['TMP'] == '1')
+
+# What --only can keep: the temperature or the orientation csv
+ONLY_CHOICES = ('temp', 'ori')
+
+def select_sensors(mini_header, only=None):
+    '''Return the mini header with the sensors that are not wanted turned off
+
+    only is None for every sensor of the file, or one of ONLY_CHOICES.
+    The data pages are still laid out by the original mini header.
+    '''
+    if only is None:
+        return mini_header
+    if only not in ONLY_CHOICES:
+        raise ValueError('only must be one of %s, not %r' % (', '.join(ONLY_CHOICES), only))
+    selected = dict(mini_header)
+    if only == 'temp':
+        selected['ACL'] = selected['MGN'] = '0'
+    else:
+        selected['TMP'] = '0'
+    return selected
+
+# Names of the sensor columns in the csv files
+TEMPERATURE_COLUMN = "Temperature (C)"
+ACCELEROMETER_COLUMNS = ("Ax (g)", "Ay (g)", "Az (g)")
+MAGNETOMETER_COLUMNS = ("Mx (mG)", "My (mG)", "Mz (mG)")
+
 # Passing in values like they come in from the mini header
 def get_ori_csv_headers(accel='1', magne='1'):
     '''Returns the header for the orientation CSV file'''
     date_header = "Date,Time"
-    accel_header = "Ax (g),Ay (g),Az (g)"
-    magne_header = "Mx (mG),My (mG),Mz (mG)"
+    accel_header = ','.join(ACCELEROMETER_COLUMNS)
+    magne_header = ','.join(MAGNETOMETER_COLUMNS)
     headers = [date_header]
     if accel == '1':
         headers.append(accel_header)
@@ -176,7 +356,7 @@ def get_ori_csv_headers(accel='1', magne='1'):
 def get_tmp_csv_headers(temp='1'):
     '''Returns the header for the Temperature CSV file'''
     date_header = "Date,Time"
-    temp_header = "Temperature (C)"
+    temp_header = TEMPERATURE_COLUMN
     headers = [date_header]
     if temp == '1':
         headers.append(temp_header)
@@ -245,31 +425,231 @@ def write_magnetometers(mgn_data, ori_buffer=None, clk=None, magnes=None, ori_de
 
 def write_orientation(ori_data, ori_buffer=None, clk=None, accels=None, magnes=None, ori_delta=None, 
                       burst_delta=None, bmn=None, orientation_format=None):
-    '''Write the orientation data to the orientation buffer'''
-    for i in xrange(int(len(ori_data)/6)):
+    '''Append the orientation rows to the orientation buffer, a list of bytes
+
+    Values are written with the padding of their lookup table.
+    '''
+    if not ori_data:
+        return
+    # Index into the lookup table buffers directly, LookupTable.__getitem__ is too slow here
+    a_buf, a_width, a_first = accels.buffer, accels.width, accels.first
+    m_buf, m_width, m_first = magnes.buffer, magnes.width, magnes.first
+    row_format = (orientation_format + '%s').encode('ascii')
+    append = ori_buffer.append
+    for i in range(int(len(ori_data)/6)):
         left = 6 * i
         right = 6 * (i + 1)
         d = ori_data[left:right]
-        ori_buffer.write(
-            (orientation_format+'%s') % (clk.isoformat(ISO_SEPARATOR)[:TRUNCATE_MICROSECOND_DIGITS], 
-                                         accels[d[0]], accels[d[1]], accels[d[2]], 
-                                         magnes[d[3]], magnes[d[4]], magnes[d[5]],
-                                         os.linesep,)
+        ax = (d[0] - a_first) * a_width
+        ay = (d[1] - a_first) * a_width
+        az = (d[2] - a_first) * a_width
+        mx = (d[3] - m_first) * m_width
+        my = (d[4] - m_first) * m_width
+        mz = (d[5] - m_first) * m_width
+        append(
+            row_format % (clk.isoformat(ISO_SEPARATOR)[:TRUNCATE_MICROSECOND_DIGITS].encode('ascii'),
+                          a_buf[ax:ax+a_width], a_buf[ay:ay+a_width], a_buf[az:az+a_width],
+                          m_buf[mx:mx+m_width], m_buf[my:my+m_width], m_buf[mz:mz+m_width],
+                          LINE_SEPARATOR,)
         )
         clk += burst_delta
 
 def write_temperature(tmp_data, tmp_buffer=None, temps=None, clk=None, tmp_delta=None):
-    '''Write the tmp data to the temperature buffer'''
+    '''Append the temperature rows to the temperature buffer, a list of bytes
+
+    Values are written with the padding of their lookup table. Raises
+    IndexError for readings the thermometer table has no value for (0xFFFF).
+    '''
+    if temps is None:
+        # TMP is off
+        return
+    t_buf, t_width = temps.buffer, temps.width
+    if tmp_data and max(tmp_data) * t_width >= len(t_buf):
+        raise IndexError(max(tmp_data))
+    append = tmp_buffer.append
     for t in tmp_data:
-        tmp_buffer.write(
-            "%s,%s%s" % (
-                clk.isoformat(ISO_SEPARATOR)[:TRUNCATE_MICROSECOND_DIGITS],
-                temps[t],
-                os.linesep,
+        start = t * t_width
+        append(
+            b"%s,%s%s" % (
+                clk.isoformat(ISO_SEPARATOR)[:TRUNCATE_MICROSECOND_DIGITS].encode('ascii'),
+                t_buf[start:start+t_width],
+                LINE_SEPARATOR,
             )
         )
         clk += tmp_delta
 
+def project_pattern(p, tmp=True, orientation=True):
+    '''Return the pattern with the readings that are not wanted turned into pad bytes
+
+    >>> project_pattern('<H1920h59H', orientation=False)
+    '<H3840x59H'
+    '''
+    def project(match):
+        wanted = orientation if match.group(2) == 'h' else tmp
+        if wanted:
+            return match.group(0)
+        return '%dx' % (int(match.group(1) or 1) * 2)
+    return p[0] + re.sub(r'(\d*)([Hh])', project, p[1:])
+
+def unpack_patterns(data_page, patterns_in_page=None, p=None, p_size=None, bmn=None,
+                    tri=None, ori=None, tmp=True, orientation=True):
+    '''Yield (t_data, o_data), the raw temperature and orientation readings of each pattern
+
+    data_page is the data page without its mini header, any bytes-like object.
+    Complete patterns are unpacked in place, a memoryview is never copied.
+    Pattern i starts i * ORI seconds after the CLK of the page.
+    With tmp or orientation False those readings are skipped over instead of
+    unpacked, and come back empty.
+    '''
+    size = len(data_page)
+    if not (tmp and orientation):
+        projected_p = project_pattern(p, tmp=tmp, orientation=orientation)
+    for i in range(patterns_in_page):
+        start = i * p_size
+        if size - start < p_size:
+            # get the number of remaining bytes
+            remaining = size - start
+            # get number of h bytes needed in original pattern
+            h_index = p.rindex('h')
+            # <H12h59H => H + 12 h = 13
+            hs = int(p[2:h_index]) + 1
+            # No partial intervals are allowed:
+            if hs * 2 > remaining:
+                # pull out one temp
+                return
+            # 60 / 2 = 30 (since each short is 2 bytes)
+            # 30 - 13 = 17 H measurements remaining
+            new_p = p[:h_index+1] + str(int(remaining/2) - hs) + 'H'
+            rest = bytes(data_page[start:])
+            end_index = rest.rfind(b'\xff' * 14)
+            if end_index > -1:
+                return
+            a = struct.unpack_from(new_p, rest)
+        elif tmp and orientation:
+            a = struct.unpack_from(p, data_page, start)
+        else:
+            # Only the wanted readings are in a
+            a = struct.unpack_from(projected_p, data_page, start)
+            yield (a, ()) if tmp else ((), a)
+            continue
+
+        t_data = a[0:1] + a[bmn*6+1:]
+        o_data = a[1:bmn * 6 + 1]
+        if tri > ori:
+            t_data = a[0:1]
+            o_data = a[1:]
+        if not tmp:
+            t_data = ()
+        if not orientation:
+            o_data = ()
+        yield t_data, o_data
+
+PageLayout = collections.namedtuple('PageLayout', [
+    'p', 'p_size', 'bmn', 'tri', 'ori', 'tmp', 'acl', 'mgn',
+    'burst_delta', 'ori_delta', 'tmp_delta',
+])
+
+def get_page_layout(mini_header):
+    '''Return the PageLayout of the data pages described by the mini header'''
+    p = pattern(int(mini_header['BMN']),
+                tri=int(mini_header['TRI']),
+                ori=int(mini_header['ORI']),
+                tmp=bool(int(mini_header['TMP'])),
+                acl=bool(int(mini_header['ACL'])),
+                mgn=bool(int(mini_header['MGN'])))
+    # we might need orientation_interval if TRI < ORI
+    temperature_interval = int(mini_header['TRI'])
+    orientation_interval = int(mini_header['ORI'])
+    burst_mode_rate = int(mini_header['BMR'])
+    # TODO: get pattern delta, might not be TRI
+    return PageLayout(p=p,
+                      p_size=struct.calcsize(p),
+                      bmn=int(mini_header['BMN']),
+                      tri=temperature_interval,
+                      ori=orientation_interval,
+                      tmp=bool(int(mini_header['TMP'])),
+                      acl=bool(int(mini_header['ACL'])),
+                      mgn=bool(int(mini_header['MGN'])),
+                      burst_delta=datetime.timedelta(milliseconds=1000/burst_mode_rate),
+                      ori_delta=datetime.timedelta(seconds=orientation_interval),
+                      tmp_delta=datetime.timedelta(seconds=temperature_interval))
+
+def pattern_word_positions(layout):
+    '''Return (tmp_positions, ori_start, ori_stop), where the readings are in a complete pattern
+
+    Positions are indexes of the shorts in the pattern, split the same way as
+    unpack_patterns: the first word and, unless TRI > ORI, every word after the
+    orientation readings are temperatures.
+    '''
+    pattern_words = layout.p_size // 2
+    if layout.tri > layout.ori:
+        return [0], 1, pattern_words
+    ori_stop = layout.bmn * 6 + 1
+    return [0] + list(range(ori_stop, pattern_words)), 1, ori_stop
+
+# Data page mini headers start with the CLK, a fixed width CLOCK_FORMAT time
+CLOCK_PREFIX = b'MHS' + HEADER_SEPARATOR + b'CLK '
+CLOCK_LENGTH = len('2013-11-15 09:04:12')
+CLOCK_END = len(CLOCK_PREFIX) + CLOCK_LENGTH
+CLOCK_SEPARATORS = '-- ::'
+
+def page_clock(data_page, mh_size):
+    '''Return the CLK in the mini header of the data page'''
+    if data_page[:len(CLOCK_PREFIX)] == CLOCK_PREFIX and \
+       data_page[CLOCK_END:CLOCK_END+len(HEADER_SEPARATOR)] == HEADER_SEPARATOR:
+        # Read straight from its offset instead of parsing the whole mini header
+        clk = bytes(data_page[len(CLOCK_PREFIX):CLOCK_END]).decode(HEADER_ENCODING)
+        if clk[4] + clk[7] + clk[10] + clk[13] + clk[16] == CLOCK_SEPARATORS:
+            try:
+                return datetime.datetime(int(clk[0:4]), int(clk[5:7]), int(clk[8:10]),
+                                         int(clk[11:13]), int(clk[14:16]), int(clk[17:19]))
+            except ValueError:
+                pass
+    mh = parse_header(data_page[:mh_size])
+    return datetime.datetime.strptime(mh['CLK'], CLOCK_FORMAT)
+
+PageReadings = collections.namedtuple('PageReadings', [
+    'clk', 'tmp_times', 'tmp_raw', 'ori_times', 'ori_raw',
+])
+
+def get_page_reader(mini_header, mh_size):
+    '''Return a function that unpacks a raw data page into PageReadings
+
+    This is the page decoder without any lookup tables or formatting:
+    clk -- datetime from the mini header of the page
+    tmp_times, ori_times -- seconds after clk of each reading
+    tmp_raw -- the raw temperature readings
+    ori_raw -- the raw orientation readings, six (ax, ay, az, mx, my, mz) per time
+    '''
+    layout = get_page_layout(mini_header)
+    ori_seconds = timedelta_seconds(layout.ori_delta)
+    tmp_seconds = timedelta_seconds(layout.tmp_delta)
+    burst_seconds = timedelta_seconds(layout.burst_delta)
+
+    def read_page(data_page):
+        clk = page_clock(data_page, mh_size)
+        data_page = memoryview(data_page)[mh_size:]
+        patterns_in_page = int(math.ceil((len(data_page)/layout.p_size)))
+        tmp_times, tmp_raw, ori_times, ori_raw = [], [], [], []
+        patterns = unpack_patterns(data_page, patterns_in_page=patterns_in_page,
+                                   p=layout.p, p_size=layout.p_size, bmn=layout.bmn,
+                                   tri=layout.tri, ori=layout.ori)
+        for i, (t_data, o_data) in enumerate(patterns):
+            pattern_start = i * ori_seconds
+            if layout.tmp:
+                tmp_times.extend(pattern_start + k * tmp_seconds for k in range(len(t_data)))
+                tmp_raw.extend(t_data)
+            rows = int(len(o_data)/6)
+            ori_times.extend(pattern_start + k * burst_seconds for k in range(rows))
+            ori_raw.extend(o_data[:rows * 6])
+        return PageReadings(clk, tmp_times, tmp_raw, ori_times, ori_raw)
+
+    return read_page
+
+def timedelta_seconds(delta):
+    '''Return the timedelta as a number of seconds'''
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
 '''The choice to return a closure is that I don't want
 to abstract the common bits because this loop runs so many times.
 If the common bits got abstracted, that would mean a function call
@@ -308,7 +688,7 @@ def get_data_page_parser(burst_delta=None, ori_delta=None, tmp_delta=None,
     def all_ori_lte_tri(data_page, patterns_in_page=None,
                     p=None, p_size=None, clk=None, ori_buffer=None,
                         tmp_buffer=None, bmn=bmn):
-        for i in xrange(patterns_in_page):
+        for i in range(patterns_in_page):
             start = i * p_size
             stop = start + p_size
 
@@ -317,7 +697,7 @@ def get_data_page_parser(burst_delta=None, ori_delta=None, tmp_delta=None,
                 # we need an entirely new pattern if this is the case
                 new_p = '<H' + str(int(len(data_page[start:])/2)-1) + 'h'
                 # TODO: \xff * 14 might come halfway in the page
-                end_index = data_page[start:].rfind('\xff' * 14)
+                end_index = data_page[start:].rfind(b'\xff' * 14)
                 if end_index > -1:
                     return
                 a = struct.unpack_from(new_p, data_page[start:])
@@ -337,39 +717,9 @@ def get_data_page_parser(burst_delta=None, ori_delta=None, tmp_delta=None,
     def all_ori_gt_tri(data_page, patterns_in_page=None,
                        p=None, p_size=None, clk=None, ori_buffer=None,
                        tmp_buffer=None, bmn=bmn):
-        for i in xrange(patterns_in_page):
-            start = i * p_size
-            stop = start + p_size
-            if len(data_page[start:stop]) < p_size:
-                new_p = pattern(bmn, ori=ori, tri=tri, tmp=tmp, acl=acl, 
-                                mgn=mgn, size=len(data_page[start:stop]))
-                # get the number of remaining bytes
-                remaining = len(data_page[start:stop])
-                # get number of h bytes needed in original pattern
-                h_index = p.rindex('h')
-                # <H12h59H => H + 12 h = 13
-                hs = int(p[2:h_index]) + 1
-                # No partial intervals are allowed:
-                if hs * 2 > remaining:
-                    # pull out one temp
-                    return
-                # 60 / 2 = 30 (since each short is 2 bytes)
-                # 30 - 13 = 17 H measurements remaining
-                new_p = p[:h_index+1] + str(int(remaining/2) - hs) + 'H'
-                end_index = data_page[start:].rfind('\xff' * 14)
-                if end_index > -1:
-                    return
-                a = struct.unpack_from(new_p, data_page[start:])
-            else:
-                a = struct.unpack_from(p, data_page[start:stop])
-
-
-            t_data = a[0:1] + a[bmn*6+1:]
-            o_data = a[1:bmn * 6 + 1]
-            if tri > ori:
-                t_data = a[0:1]
-                o_data = a[1:]
-    
+        for t_data, o_data in unpack_patterns(data_page, patterns_in_page=patterns_in_page,
+                                              p=p, p_size=p_size, bmn=bmn, tri=tri, ori=ori,
+                                              tmp=tmp, orientation=acl or mgn):
             write_temperature(t_data, tmp_buffer=tmp_buffer, temps=temps, clk=clk,
                               tmp_delta=tmp_delta)
             write_orientation(o_data, ori_buffer=ori_buffer, clk=clk, accels=accels,
@@ -380,13 +730,97 @@ def get_data_page_parser(burst_delta=None, ori_delta=None, tmp_delta=None,
 
     return all_ori_gt_tri
 
-        
-def parse_file(lid_filename, ori_fh, temp_fh, default_host_storage=False, debugger=False):
-    global DEBUG
-    DEBUG = debugger
-    # Microsecond is used to add a bit of time to a number to get decimal points. 
+
+def get_page_decoder(mini_header, hss, mh_size, lookup_tables=None, only=None, as_bytes=False):
+    '''Return a function that turns a raw data page into (orientation, temperature) text
+
+    Everything the decoder needs is built from the main header so the same
+    decoder can be rebuilt inside a worker process. lookup_tables are the
+    (accels, magnes, temps) from get_lookup_tables, built here when not given.
+    With only (see select_sensors) the other readings are not even unpacked
+    and their text is empty. With as_bytes the text is ASCII bytes, for
+    writing straight to a binary file.
+    '''
+    # Microsecond is used to add a bit of time to a number to get decimal points.
     microsecond = datetime.timedelta(microseconds=1)
 
+    selected = select_sensors(mini_header, only)
+    orientation_format = get_orientation_format(accel=selected['ACL'], magne=selected['MGN'])
+    if lookup_tables is None:
+        lookup_tables = get_sensor_lookup_tables(selected, hss)
+    accels, magnes, temps = lookup_tables
+    layout = get_page_layout(mini_header)
+    p = layout.p
+    p_size = layout.p_size
+
+    parse_data_page = get_data_page_parser(burst_delta=layout.burst_delta,
+                                           ori_delta=layout.ori_delta,
+                                           tmp_delta=layout.tmp_delta,
+                                           orientation_format=orientation_format,
+                                           temps=temps, accels=accels, magnes=magnes,
+                                           tmp=selected['TMP'] == '1',
+                                           acl=selected['ACL'] == '1',
+                                           mgn=selected['MGN'] == '1',
+                                           tri=layout.tri,
+                                           ori=layout.ori,
+                                           bmn=layout.bmn,)
+
+    def decode_page(data_page):
+        ori_buffer = []
+        tmp_buffer = []
+
+        # Add a microsecond here to get the .000.
+        # Does not effect rounding because it gets chopped off
+        clk = page_clock(data_page, mh_size) + microsecond
+
+        # TODO: look for \xff\xff\xff\xff
+        data_page = memoryview(data_page)[mh_size:]
+
+        patterns_in_page = int(math.ceil((len(data_page)/p_size)))
+
+        # writing things to ori_buffer and tmp_buffer are the only real side effects
+        parse_data_page(data_page, patterns_in_page=patterns_in_page,
+                        p=p, p_size=p_size, clk=clk, ori_buffer=ori_buffer,
+                        tmp_buffer=tmp_buffer)
+
+        # Drop the lookup table padding
+        ori_bytes = b''.join(ori_buffer).replace(b' ', b'')
+        tmp_bytes = b''.join(tmp_buffer).replace(b' ', b'')
+        if as_bytes:
+            return ori_bytes, tmp_bytes
+        return ori_bytes.decode('ascii'), tmp_bytes.decode('ascii')
+
+    return decode_page
+
+# Each worker process of the decoder pool keeps its own page decoder here.
+_worker_page_decoder = None
+
+def init_worker_page_decoder(mini_header, hss, mh_size, lookup_tables, only=None,
+                             as_bytes=False):
+    '''Pool initializer: build the page decoder once per worker process'''
+    global _worker_page_decoder
+    _worker_page_decoder = get_page_decoder(mini_header, hss, mh_size, lookup_tables, only=only,
+                                            as_bytes=as_bytes)
+
+def start_decoder_pool(workers, mini_header, hss, mh_size, only=None, as_bytes=False):
+    '''Return a Pool of processes that each decode pages with worker_decode_page
+
+    The lookup tables are built once here, every worker reads the same
+    shared copy.
+    '''
+    import multiprocessing
+    lookup_tables = [table and table.share()
+                     for table in get_sensor_lookup_tables(select_sensors(mini_header, only), hss)]
+    return multiprocessing.Pool(workers, initializer=init_worker_page_decoder,
+                                initargs=(mini_header, hss, mh_size, lookup_tables, only,
+                                          as_bytes))
+
+def worker_decode_page(data_page):
+    '''Decode a data page with the page decoder of this worker process'''
+    return _worker_page_decoder(data_page)
+
+def count_data_pages(lid_filename):
+    '''Return the number of data pages in the lid file'''
     # Entire file is this big (bytes)
     file_size = os.path.getsize(lid_filename)
 
@@ -394,7 +828,118 @@ def parse_file(lid_filename, ori_fh, temp_fh, default_host_storage=False, debugg
     data_size = file_size - MAIN_HEADER_SIZE
 
     # The number of data pages that fit in this data
-    num_pages = int(math.ceil(data_size/DATA_PAGE_SIZE))
+    return int(math.ceil(data_size/DATA_PAGE_SIZE))
+
+def read_data_pages(lid, num_pages):
+    '''Yield (page_number, data_page) for every data page in the file'''
+    for page_number in range(num_pages):
+        # Seek to the start of the data page
+        lid.seek(MAIN_HEADER_SIZE + DATA_PAGE_SIZE * page_number, os.SEEK_SET)
+
+        # Read the whole data page
+        yield page_number, lid.read(DATA_PAGE_SIZE)
+
+'''The pipeline has three stages connected by bounded queues:
+
+    reader thread -> decoder (this thread, optionally a process pool) -> writer thread
+
+The queues are what keep the memory bounded: a stage that gets ahead of the
+next one blocks until there is room again. Nothing ever blocks forever though,
+a stage that fails sets `stop` and every other stage notices it within
+QUEUE_POLL_SECONDS and returns.
+'''
+# Put on a queue after the last item
+_END_OF_STREAM = object()
+
+def _put(queue, item, stop):
+    '''Put item on the queue unless the pipeline stops first. Returns True if it was put'''
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=QUEUE_POLL_SECONDS)
+            return True
+        except Full:
+            pass
+    return False
+
+def _get(queue, stop):
+    '''Get the next item from the queue, _END_OF_STREAM if the pipeline stops first'''
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=QUEUE_POLL_SECONDS)
+        except Empty:
+            pass
+    return _END_OF_STREAM
+
+def _start_stage(target, stop, *args):
+    '''Run target(stop, *args) in a thread, the returned list collects its exception'''
+    errors = []
+    def run():
+        try:
+            target(stop, *args)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread, errors
+
+def _read_stage(stop, lid, num_pages, pages):
+    '''Prefetch data pages from disk into the pages queue'''
+    for item in read_data_pages(lid, num_pages):
+        if not _put(pages, item, stop):
+            return
+    _put(pages, _END_OF_STREAM, stop)
+
+def _write_stage(stop, decoded_pages, ori_fh, temp_fh):
+    '''Write decoded pages out in the order they come in'''
+    while True:
+        decoded = _get(decoded_pages, stop)
+        if decoded is _END_OF_STREAM:
+            return
+        ori_text, tmp_text = decoded
+        ori_fh.write(ori_text)
+        temp_fh.write(tmp_text)
+
+def _decode_stage(stop, pages, decode_page, pool=None, queue_depth=DEFAULT_QUEUE_DEPTH):
+    '''Yield decoded pages in page order.
+
+    With a pool at most queue_depth pages are being decoded at any time.
+    '''
+    pending = collections.deque()
+    while True:
+        item = _get(pages, stop)
+        if item is _END_OF_STREAM:
+            break
+        page_number, data_page = item
+        debug(page_number)
+        if pool is None:
+            yield decode_page(data_page)
+            continue
+        pending.append(pool.apply_async(worker_decode_page, (data_page,)))
+        if len(pending) >= queue_depth:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def parse_file(lid_filename, ori_fh, temp_fh, default_host_storage=False, debugger=False,
+               workers=0, queue_depth=DEFAULT_QUEUE_DEPTH, only=None):
+    '''Convert the lid file, writing the orientation and temperature CSVs
+
+    Reading, decoding and writing overlap: pages are read by one thread and
+    written by another while they are decoded in between. With workers > 0 the
+    decoding happens in a pool of that many processes. queue_depth is how many
+    pages each stage can get ahead of the next one. With only='temp' or
+    only='ori' just that csv is converted, the other one only gets Date,Time
+    as its header.
+    '''
+    global DEBUG
+    DEBUG = debugger
+
+    if queue_depth < 1:
+        # A Queue with maxsize 0 has no limit, the reader would read the whole file
+        raise ValueError('queue_depth must be at least 1, not %r' % queue_depth)
+    num_pages = count_data_pages(lid_filename)
     with open(lid_filename, 'rb') as lid:
         header_bytes = lid.read(MAIN_HEADER_SIZE)
         header, mini_header, hss, mh_size = parse_main_header(header_bytes)
@@ -404,90 +949,151 @@ def parse_file(lid_filename, ori_fh, temp_fh, default_host_storage=False, debugg
             hss = DEFAULT_HOST_STORAGE
 
         # Get everything that requires the main/mini header data/hss
-        ori_csv_headers = get_ori_csv_headers(accel=mini_header['ACL'], magne=mini_header['MGN'])
-        tmp_csv_headers = get_tmp_csv_headers(temp=mini_header['TMP'])
-        orientation_format = get_orientation_format(accel=mini_header['ACL'], magne=mini_header['MGN'])
-        accels = build_accelerometer_values(hss['AXA'], hss['AXB'])
-        magnes = build_magnetometer_values(hss['MXA'], hss['MXS'])
-        temps = build_thermometer_values(hss['TMA'], hss['TMB'], hss['TMC'], hss['TMO'], hss['TMR'])
-        p = pattern(int(mini_header['BMN']), 
-                    tri=int(mini_header['TRI']), 
-                    ori=int(mini_header['ORI']),
-                    tmp=bool(int(mini_header['TMP'])), 
-                    acl=bool(int(mini_header['ACL'])), 
-                    mgn=bool(int(mini_header['MGN'])))
-        p_size = struct.calcsize(p)
-        # we might need orientation_interval if TRI < ORI
-        temperature_interval = int(mini_header['TRI'])
-        orientation_interval = int(mini_header['ORI'])
-        burst_mode_rate = int(mini_header['BMR'])
-        burst_delta = datetime.timedelta(milliseconds=1000/burst_mode_rate)
-        # TODO: get pattern delta, might not be TRI
-        orientation_delta = datetime.timedelta(seconds=orientation_interval)
-        temperature_delta = datetime.timedelta(seconds=temperature_interval)
+        selected = select_sensors(mini_header, only)
+        ori_csv_headers = get_ori_csv_headers(accel=selected['ACL'], magne=selected['MGN'])
+        tmp_csv_headers = get_tmp_csv_headers(temp=selected['TMP'])
 
         # File I/O
         ori_fh.write(ori_csv_headers)
-        tmp_buffer = StringIO()
-
-        parse_data_page = get_data_page_parser(burst_delta=burst_delta, 
-                                               ori_delta=orientation_delta,
-                                               tmp_delta=temperature_delta,
-                                               orientation_format=orientation_format,
-                                               temps=temps, accels=accels, magnes=magnes,
-                                               tmp=bool(int(mini_header['TMP'])),
-                                               acl=bool(int(mini_header['ACL'])), 
-                                               mgn=bool(int(mini_header['MGN'])),
-                                               tri=int(mini_header['TRI']),
-                                               ori=int(mini_header['ORI']),
-                                               bmn=int(mini_header['BMN']),)
-
-
-        for page_number in xrange(num_pages):
-            debug(page_number)
-            ori_buffer = StringIO()
-
-            # Seek to the start of the data page
-            lid.seek(MAIN_HEADER_SIZE + DATA_PAGE_SIZE * page_number, os.SEEK_SET)
-
-            # Read the whole data page
-            data_page = lid.read(DATA_PAGE_SIZE)
-
-            # Pull out the mini header
-            mh = parse_header(data_page[:mh_size])
-
-            # TODO: look for \xff\xff\xff\xff
-            data_page = data_page[mh_size:]
-
-            patterns_in_page = int(math.ceil((len(data_page)/p_size)))
-
-            # Add a microsecond here to get the .000.
-            # Does not effect rounding because it gets chopped off
-            clk = datetime.datetime.strptime(mh['CLK'], CLOCK_FORMAT) + microsecond
-
-            # writing things to ori_buffer and tmp_buffer are the only real side effects
-            parse_data_page(data_page, patterns_in_page=patterns_in_page,
-                            p=p, p_size=p_size, clk=clk, ori_buffer=ori_buffer,
-                            tmp_buffer=tmp_buffer)
-
-            ori_fh.write(ori_buffer.getvalue())
-            ori_buffer.close()
-
-            
-    temp_fh.write(tmp_csv_headers)
-    temp_fh.write(tmp_buffer.getvalue())
-    tmp_buffer.close()
+        temp_fh.write(tmp_csv_headers)
+
+        pool = None
+        decode_page = None
+        if workers > 0:
+            pool = start_decoder_pool(workers, mini_header, hss, mh_size, only=only)
+        else:
+            decode_page = get_page_decoder(mini_header, hss, mh_size, only=only)
+
+        stop = threading.Event()
+        pages = Queue(maxsize=queue_depth)
+        decoded_pages = Queue(maxsize=queue_depth)
+        reader, reader_errors = _start_stage(_read_stage, stop, lid, num_pages, pages)
+        writer, writer_errors = _start_stage(_write_stage, stop, decoded_pages, ori_fh, temp_fh)
+        try:
+            for decoded in _decode_stage(stop, pages, decode_page, pool=pool,
+                                         queue_depth=queue_depth):
+                if not _put(decoded_pages, decoded, stop):
+                    break
+            _put(decoded_pages, _END_OF_STREAM, stop)
+            writer.join()
+        finally:
+            stop.set()
+            reader.join()
+            writer.join()
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        for errors in (reader_errors, writer_errors):
+            if errors:
+                raise errors[0]
+
+def print_info(lid_filename):
+    '''Print the main header, mini header and host storage of a lid file'''
+    with open(lid_filename, 'rb') as lid:
+        header, mini_header, hss, mh_size = parse_main_header(lid.read(MAIN_HEADER_SIZE))
+    for title, values in (('Header', header), ('Mini header', mini_header), ('Host storage', hss)):
+        print(title)
+        for tag in sorted(values):
+            print('  %s %s' % (tag, values[tag]))
+
+def positive_int(text):
+    '''argparse type for counts that have to be at least 1'''
+    value = int(text)
+    if value < 1:
+        raise ValueError(text)
+    return value
+
+def port_number(text):
+    '''argparse type for TCP ports, 0 picks a free one'''
+    value = int(text)
+    if not 0 <= value <= 65535:
+        raise ValueError(text)
+    return value
 
 def main():
-    if len(sys.argv) < 2:
-        print("Need to specify a file")
+    # Only imported here so that importing matp stays cheap
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert a lid file to ori.csv and tmp.csv')
     # TODO: Check to make sure file exists
-    infile = sys.argv[1]
-    default_host_storage = False
-    if len(sys.argv) > 2:
-        default_host_storage = sys.argv[2]
+    parser.add_argument('infile', nargs='?', help='the lid file to convert')
+    parser.add_argument('default_host_storage', nargs='?', default=False,
+                        help='if given, use the default host storage instead of the HSS in the file')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of processes decoding pages (default: decode in this process)')
+    parser.add_argument('--queue-depth', type=positive_int,
+                        help='number of pages buffered between read, decode and write, '
+                             'per file with --merge')
+    parser.add_argument('--info', action='store_true',
+                        help='print the headers of the file instead of converting it')
+    parser.add_argument('--summary', metavar='INTERVAL',
+                        help='write per interval statistics to summary.csv instead, '
+                             'INTERVAL is like hour, day, 15m or 3600')
+    parser.add_argument('--validate', action='store_true',
+                        help='check every data page and report problems instead of converting, '
+                             'exits with status 1 if there are any')
+    parser.add_argument('--only', choices=ONLY_CHOICES,
+                        help='only convert the temperature (tmp.csv) or orientation (ori.csv) '
+                             'readings, the others are not decoded')
+    parser.add_argument('--merge', nargs='+', metavar='LID',
+                        help='also convert these lid files and merge them with infile by time, '
+                             'with a Logger column')
+    parser.add_argument('--serve', action='store_true',
+                        help='keep running and convert files requested over http on localhost '
+                             'instead (see matp/server.py)')
+    parser.add_argument('--segments', action='store_true',
+                        help='have each of the --workers processes (default: one per CPU) write '
+                             'its pages straight to a segment file, the segments are then '
+                             'joined into the csv files (see matp/segments.py)')
+    parser.add_argument('--port', type=port_number,
+                        help='port to serve on with --serve, 0 for any free one')
+    parser.add_argument('--max-jobs', type=positive_int,
+                        help='number of files converted at a time with --serve')
+    args = parser.parse_args()
+    kwargs = {}
+    if args.queue_depth is not None:
+        kwargs['queue_depth'] = args.queue_depth
+    if args.serve:
+        from matp import server
+        for name in ('port', 'max_jobs'):
+            if getattr(args, name) is not None:
+                kwargs[name] = getattr(args, name)
+        server.serve(workers=args.workers, **kwargs)
+        return
+    if args.infile is None:
+        parser.error('infile is required')
+    if args.validate:
+        from matp import validate
+        if validate.write_report(validate.validate_file(args.infile), sys.stdout):
+            sys.exit(1)
+        return
+    if args.info:
+        print_info(args.infile)
+        return
+    if args.summary:
+        from matp import summary
+        try:
+            interval = summary.parse_interval(args.summary)
+        except ValueError as e:
+            parser.error(str(e))
+        with open("summary.csv", "w") as fh:
+            summary.write_summary(summary.summarize_file(
+                args.infile, interval, default_host_storage=args.default_host_storage), fh)
+        return
+    if args.merge:
+        from matp import fleet
+        with open("ori.csv", "w") as ori, open("tmp.csv", "w") as tmp:
+            fleet.export_fleet([args.infile] + args.merge, ori, tmp,
+                               default_host_storage=args.default_host_storage,
+                               workers=args.workers, only=args.only, **kwargs)
+        return
+    if args.segments:
+        from matp import segments
+        segments.convert_file(args.infile, "ori.csv", "tmp.csv", workers=args.workers,
+                              default_host_storage=args.default_host_storage, only=args.only)
+        return
     with open("ori.csv", "w") as ori, open("tmp.csv", "w") as tmp:
-        parse_file(infile, ori, tmp, default_host_storage=default_host_storage, debugger=True)
+        parse_file(args.infile, ori, tmp, default_host_storage=args.default_host_storage,
+                   debugger=True, workers=args.workers, only=args.only, **kwargs)
     
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+'''Convert one big lid file in parallel, each worker writing its own part of the csv files.
+
+The data pages are split into segments of consecutive pages. Each worker
+process decodes a segment and writes its rows to segment files of its own,
+the parent only appends the finished segment files to the csv files in page
+order, with os.copy_file_range or os.sendfile so the rows never pass through
+it. The csv files come out exactly as parse_file writes them.
+'''
+from __future__ import division
+import collections
+import os
+import shutil
+import tempfile
+
+from matp import mat
+
+# Data pages converted by a worker at a time
+DEFAULT_SEGMENT_PAGES = 16
+# Segments being converted or waiting to be appended per worker, which bounds the
+# disk space used by segment files
+SEGMENTS_PER_WORKER = 2
+
+def convert_segment(lid_filename, first_page, stop_page, ori_segment, tmp_segment):
+    '''Decode pages first_page up to stop_page into the two segment files
+
+    Runs in a worker process of mat.start_decoder_pool with as_bytes.
+    '''
+    with open(lid_filename, 'rb') as lid, open(ori_segment, 'wb') as ori, \
+         open(tmp_segment, 'wb') as tmp:
+        lid.seek(mat.MAIN_HEADER_SIZE + mat.DATA_PAGE_SIZE * first_page, os.SEEK_SET)
+        for page_number in range(first_page, stop_page):
+            ori_bytes, tmp_bytes = mat.worker_decode_page(lid.read(mat.DATA_PAGE_SIZE))
+            ori.write(ori_bytes)
+            tmp.write(tmp_bytes)
+
+def append_file(filename, fh):
+    '''Append the contents of the file to the open binary file fh, in the kernel when possible'''
+    fh.flush()
+    with open(filename, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        copied = 0
+        try:
+            while copied < size:
+                if hasattr(os, 'copy_file_range'):
+                    n = os.copy_file_range(src.fileno(), fh.fileno(), size - copied)
+                else:
+                    n = os.sendfile(fh.fileno(), src.fileno(), copied, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except (AttributeError, OSError):
+            # Not supported between these files, the copy below reports real errors
+            pass
+        # The kernel moved the file position, keep the python file object in step
+        fh.seek(0, os.SEEK_END)
+        if copied < size:
+            src.seek(copied)
+            shutil.copyfileobj(src, fh)
+
+def convert_file(lid_filename, ori_filename, tmp_filename, workers=None,
+                 segment_pages=DEFAULT_SEGMENT_PAGES, default_host_storage=False, only=None):
+    '''Write the orientation and temperature csv files of the lid file
+
+    workers is the number of worker processes, the number of CPUs by default.
+    The output is the same as parse_file's. Segment files are kept next to the
+    csv files so that they can be copied on the same file system, at most
+    SEGMENTS_PER_WORKER of them per worker at a time.
+    '''
+    workers = workers or os.cpu_count() or 1
+    num_pages = mat.count_data_pages(lid_filename)
+    with open(lid_filename, 'rb') as lid:
+        header, mini_header, hss, mh_size = mat.parse_main_header(lid.read(mat.MAIN_HEADER_SIZE))
+    if default_host_storage:
+        hss = mat.DEFAULT_HOST_STORAGE
+    selected = mat.select_sensors(mini_header, only)
+
+    directory = tempfile.mkdtemp(prefix='.segments-',
+                                 dir=os.path.dirname(os.path.abspath(ori_filename)))
+    pool = mat.start_decoder_pool(workers, mini_header, hss, mh_size, only=only, as_bytes=True)
+    try:
+        with open(ori_filename, 'wb') as ori, open(tmp_filename, 'wb') as tmp:
+            ori.write(mat.get_ori_csv_headers(accel=selected['ACL'],
+                                              magne=selected['MGN']).encode('ascii'))
+            tmp.write(mat.get_tmp_csv_headers(temp=selected['TMP']).encode('ascii'))
+
+            pending = collections.deque()
+            starts = iter(range(0, num_pages, segment_pages))
+            while True:
+                for first_page in starts:
+                    segment = [os.path.join(directory, '%d.%s' % (first_page, name))
+                               for name in ('ori', 'tmp')]
+                    stop_page = min(first_page + segment_pages, num_pages)
+                    pending.append((pool.apply_async(convert_segment, [lid_filename, first_page,
+                                                                       stop_page] + segment),
+                                    segment))
+                    if len(pending) >= workers * SEGMENTS_PER_WORKER:
+                        break
+                if not pending:
+                    break
+                result, segment = pending.popleft()
+                result.get()
+                for filename, fh in zip(segment, (ori, tmp)):
+                    append_file(filename, fh)
+                    os.remove(filename)
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(directory, ignore_errors=True)
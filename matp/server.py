@@ -0,0 +1,191 @@
+'''A long running converter, taking conversion jobs over HTTP on localhost.
+
+Converting a file from a running server skips the interpreter start up, the
+imports and, for loggers it has seen before, building the lookup tables:
+every process keeps the tables of the last few calibrations (see
+mat.LOOKUP_TABLE_CACHE_SIZE) and the page decoders of the last few files.
+
+    GET /convert?path=<lid file>&csv=tmp|ori[&default_host_storage=1]
+        streams the csv back page by page, like parse_file would write it
+    GET /jobs
+        JSON with the running jobs and throughput of the last finished ones
+
+At most max_jobs files are converted at a time, other jobs wait for their
+turn. With workers > 0 the pages of all jobs are decoded in one pool of that
+many processes.
+'''
+from __future__ import division
+import collections
+import contextlib
+import itertools
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from matp import mat
+from matp import fleet
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8537
+DEFAULT_MAX_JOBS = 2
+# Number of finished jobs reported by /jobs
+JOB_HISTORY = 100
+
+CSV_CHOICES = {'tmp': 'temp', 'ori': 'ori'}
+
+class ConverterHandler(BaseHTTPRequestHandler):
+    '''Handles one request, the server has the pool and the job bookkeeping'''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+        if url.path == '/convert':
+            self.convert(query)
+        elif url.path == '/jobs':
+            self.send_json(200, self.server.job_report())
+        else:
+            self.send_json(404, {'error': 'no such path %s' % url.path})
+
+    def send_json(self, status, value):
+        body = json.dumps(value, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, data):
+        '''Write a chunk of a chunked response, an empty one ends it'''
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def convert(self, query):
+        path = query.get('path')
+        csv = query.get('csv', 'tmp')
+        if not path or csv not in CSV_CHOICES:
+            self.send_json(400, {'error': 'convert needs path=<lid file> and csv=tmp or csv=ori'})
+            return
+        if not os.path.isfile(path):
+            self.send_json(404, {'error': 'no such file %s' % path})
+            return
+        only = CSV_CHOICES[csv]
+        default_host_storage = query.get('default_host_storage', '0') not in ('', '0')
+        # Anything wrong with the headers is reported before the 200 is sent
+        try:
+            with open(path, 'rb') as lid:
+                header, mini_header, hss, mh_size = mat.parse_main_header(
+                    lid.read(mat.MAIN_HEADER_SIZE))
+            mat.get_page_layout(mini_header)
+            selected = mat.select_sensors(mini_header, only)
+            if only == 'temp':
+                csv_header = mat.get_tmp_csv_headers(temp=selected['TMP'])
+            else:
+                csv_header = mat.get_ori_csv_headers(accel=selected['ACL'], magne=selected['MGN'])
+        except (ValueError, KeyError, ZeroDivisionError, struct.error) as e:
+            self.send_json(400, {'error': '%s is not a lid file that can be read: %r' % (path, e)})
+            return
+
+        with self.server.job(path, csv) as job:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.write_chunk(csv_header.encode('ascii'))
+            text = 1 if only == 'temp' else 0
+            for decoded in fleet.decode_file(path, only=only,
+                                             default_host_storage=default_host_storage,
+                                             pool=self.server.pool,
+                                             queue_depth=self.server.queue_depth):
+                data = decoded[text].encode('ascii')
+                if data:
+                    self.write_chunk(data)
+                job['pages'] += 1
+                job['output_bytes'] += len(data)
+        # Only end the response once the job is finished, so /jobs reports it
+        self.write_chunk(b'')
+
+    def log_message(self, format, *args):
+        sys.stderr.write('%s %s%s' % (self.log_date_time_string(), format % args, os.linesep))
+
+class ConverterServer(ThreadingHTTPServer):
+    '''HTTP server converting at most max_jobs files at a time'''
+    daemon_threads = True
+
+    def __init__(self, address, workers=0, max_jobs=DEFAULT_MAX_JOBS,
+                 queue_depth=mat.DEFAULT_QUEUE_DEPTH):
+        if max_jobs < 1:
+            # No job would ever get a slot
+            raise ValueError('max_jobs must be at least 1, not %r' % max_jobs)
+        ThreadingHTTPServer.__init__(self, address, ConverterHandler)
+        self.pool = None
+        if workers > 0:
+            import multiprocessing
+            self.pool = multiprocessing.Pool(workers)
+        self.queue_depth = queue_depth
+        self.slots = threading.BoundedSemaphore(max_jobs)
+        self.lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        self.running = {}
+        self.finished = collections.deque(maxlen=JOB_HISTORY)
+
+    @contextlib.contextmanager
+    def job(self, path, csv):
+        '''Wait for a free slot, then keep the metrics of the job while it runs'''
+        info = {
+            'id': next(self.job_ids), 'path': path, 'csv': csv, 'status': 'waiting',
+            'input_bytes': os.path.getsize(path), 'output_bytes': 0, 'pages': 0,
+        }
+        queued = time.time()
+        with self.lock:
+            self.running[info['id']] = info
+        with self.slots:
+            started = time.time()
+            info['status'] = 'running'
+            info['wait_seconds'] = started - queued
+            try:
+                yield info
+                info['status'] = 'done'
+            except Exception as e:
+                info['status'] = 'failed: %s' % e
+                raise
+            finally:
+                info['seconds'] = time.time() - started
+                seconds = max(info['seconds'], 1e-9)
+                info['pages_per_second'] = info['pages'] / seconds
+                info['input_mb_per_second'] = info['input_bytes'] / seconds / 1e6
+                info['output_mb_per_second'] = info['output_bytes'] / seconds / 1e6
+                with self.lock:
+                    del self.running[info['id']]
+                    self.finished.append(info)
+                sys.stderr.write('job %(id)d %(path)s %(csv)s %(status)s: %(pages)d pages in '
+                                 '%(seconds).3fs, %(input_mb_per_second).1f MB/s%(linesep)s'
+                                 % dict(info, linesep=os.linesep))
+
+    def job_report(self):
+        with self.lock:
+            return {'running': list(self.running.values()), 'finished': list(self.finished)}
+
+    def server_close(self):
+        ThreadingHTTPServer.server_close(self)
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=0, max_jobs=DEFAULT_MAX_JOBS,
+          queue_depth=mat.DEFAULT_QUEUE_DEPTH):
+    '''Serve conversions until interrupted'''
+    server = ConverterServer((host, port), workers=workers, max_jobs=max_jobs,
+                             queue_depth=queue_depth)
+    sys.stderr.write('converting lid files on http://%s:%d/convert%s'
+                     % (server.server_address[0], server.server_address[1], os.linesep))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,173 @@
+'''Per interval statistics of a lid file, computed in one streaming pass.
+
+Nothing but the statistics of the intervals that are still being filled is
+kept around, so memory does not grow with the size of the file.
+'''
+from __future__ import division
+import array
+import datetime
+import math
+import os
+import re
+
+from matp import mat
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+INTERVAL_NAMES = {
+    'minute': 60,
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+}
+INTERVAL_UNITS = {
+    's': 1,
+    'm': 60,
+    'h': 60 * 60,
+    'd': 24 * 60 * 60,
+}
+
+SUMMARY_CSV_HEADER = 'Date,Time,Sensor,Count,Mean,Min,Max,Std'
+
+# Sensor name, and the precision it is written with. Same as the csv files.
+TEMPERATURE = (mat.TEMPERATURE_COLUMN, 4)
+ACCELEROMETER = tuple((name, 5) for name in mat.ACCELEROMETER_COLUMNS)
+MAGNETOMETER = tuple((name, 2) for name in mat.MAGNETOMETER_COLUMNS)
+
+def parse_interval(text):
+    '''Return the number of seconds in an interval like "hour", "day", "15m" or "3600"
+
+    >>> parse_interval('hour')
+    3600
+    >>> parse_interval('15m')
+    900
+    '''
+    text = text.strip().lower()
+    if text in INTERVAL_NAMES:
+        return INTERVAL_NAMES[text]
+    match = re.match(r'^(\d+)([smhd]?)$', text)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError('Not an interval: %r' % text)
+    return int(match.group(1)) * INTERVAL_UNITS.get(match.group(2) or 's')
+
+class RunningStats(object):
+    '''Count, mean, min, max and standard deviation of a stream of values
+
+    Values are added a batch at a time, each batch is merged into the running
+    mean and sum of squared differences (Welford, Chan et al.) so the values
+    themselves never need to be kept.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def update(self, values):
+        '''Add a batch of values'''
+        n = len(values)
+        if not n:
+            return
+        mean = sum(values) / n
+        m2 = sum((v - mean) ** 2 for v in values)
+        delta = mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        low, high = min(values), max(values)
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def std(self):
+        '''Sample standard deviation, None for less than two values'''
+        if self.count < 2:
+            return None
+        return math.sqrt(self.m2 / (self.count - 1))
+
+def _add_readings(intervals, sensor, page_start, times, values, interval):
+    '''Add each value to the stats of the sensor in the interval its time falls in'''
+    buckets = [int((page_start + t) // interval) for t in times]
+    begin = 0
+    for end in range(1, len(buckets) + 1):
+        if end == len(buckets) or buckets[end] != buckets[begin]:
+            stats = intervals.setdefault(buckets[begin], {})
+            stats.setdefault(sensor, RunningStats()).update(values[begin:end])
+            begin = end
+
+def _flush(intervals, sensors, interval, before=None):
+    '''Yield and forget the intervals that start before the given one (all by default)'''
+    for bucket in sorted(intervals):
+        if before is not None and bucket >= before:
+            break
+        start = EPOCH + datetime.timedelta(seconds=bucket * interval)
+        for sensor in sensors:
+            if sensor in intervals[bucket]:
+                yield start, sensor, intervals[bucket][sensor]
+        del intervals[bucket]
+
+def summarize_file(lid_filename, interval, default_host_storage=False):
+    '''Yield (interval_start, sensor, RunningStats) for every interval with readings
+
+    interval is a number of seconds, intervals are aligned to midnight.
+    sensor is a (name, precision) pair. Temperature readings of 0 and 0xFFFF
+    are not valid and are left out. Data pages are expected to go forward
+    in time, an interval is yielded as soon as a page starts after it.
+    '''
+    with open(lid_filename, 'rb') as lid:
+        header, mini_header, hss, mh_size = mat.parse_main_header(lid.read(mat.MAIN_HEADER_SIZE))
+        if default_host_storage:
+            hss = mat.DEFAULT_HOST_STORAGE
+        layout = mat.get_page_layout(mini_header)
+        read_page = mat.get_page_reader(mini_header, mh_size)
+
+        sensors = []
+        if layout.tmp:
+            sensors.append(TEMPERATURE)
+            temps = array.array('d', mat.thermometer_values(hss['TMA'], hss['TMB'], hss['TMC'],
+                                                            hss['TMO'], hss['TMR']))
+        # (sensor, scale, offset, position in each orientation reading), calibrated like
+        # the orientation csv
+        channels = []
+        if layout.acl:
+            channels.extend((sensor, 1/hss['AXB'], hss['AXA'], i)
+                            for i, sensor in enumerate(ACCELEROMETER))
+        if layout.mgn:
+            channels.extend((sensor, hss['MXS'], hss['MXA'], i + 3)
+                            for i, sensor in enumerate(MAGNETOMETER))
+        sensors.extend(channel[0] for channel in channels)
+
+        intervals = {}
+        for page_number, data_page in mat.read_data_pages(lid, mat.count_data_pages(lid_filename)):
+            readings = read_page(data_page)
+            page_start = mat.timedelta_seconds(readings.clk - EPOCH)
+            if readings.tmp_times:
+                valid = [(t, temps[raw]) for t, raw in zip(readings.tmp_times, readings.tmp_raw)
+                         if 0 < raw < mat.MAX_UNSIGNED_SHORT]
+                _add_readings(intervals, TEMPERATURE, page_start,
+                              [t for t, value in valid], [value for t, value in valid], interval)
+            if readings.ori_times:
+                for sensor, scale, offset, i in channels:
+                    values = [scale * raw + offset for raw in readings.ori_raw[i::6]]
+                    _add_readings(intervals, sensor, page_start, readings.ori_times, values,
+                                  interval)
+            firsts = [times[0] for times in (readings.tmp_times, readings.ori_times) if times]
+            if firsts:
+                # Nothing in this page or later comes before its first reading
+                for row in _flush(intervals, sensors, interval,
+                                  before=int((page_start + min(firsts)) // interval)):
+                    yield row
+        for row in _flush(intervals, sensors, interval):
+            yield row
+
+def write_summary(summary, fh):
+    '''Write the rows from summarize_file as csv'''
+    fh.write(SUMMARY_CSV_HEADER + os.linesep)
+    for start, (name, precision), stats in summary:
+        std = stats.std()
+        fh.write('%s,%s,%d,%.*f,%.*f,%.*f,%s%s' % (
+            start.isoformat(mat.ISO_SEPARATOR), name, stats.count,
+            precision, stats.mean, precision, stats.min, precision, stats.max,
+            '' if std is None else '%.*f' % (precision, std),
+            os.linesep,
+        ))
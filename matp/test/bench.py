@@ -0,0 +1,300 @@
+'''Convert every sample with every engine, check the outputs match and time them.
+
+Every sample under samples/ and a scaled up copy of each (see
+make_synthetic_lid) is converted by each of ENGINES. Every engine has to give
+exactly the output of the sequential parse_file, and that output has to have
+the checksum committed in sample_checksums.json. When numpy and pandas are
+installed the output is also compared to the numbers read_lid decodes on its
+own. Throughput is compared to the timing baseline, a file and engine that got
+more than --threshold slower fails.
+
+    python -m matp.test.bench --record     # write the timing baseline of this machine
+    python -m matp.test.bench              # check against it, exit status 1 on failures
+
+Timings depend on the machine, record the baseline on the one it is checked
+on. The checksums do not, they only change with --record-checksums when the
+output is meant to change.
+'''
+from __future__ import division
+import collections
+import glob
+import hashlib
+import io
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from matp import mat, segments
+
+CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
+SAMPLES_DIR = os.path.join(CURRENT_DIR, 'samples')
+DEFAULT_BASELINE = os.path.join(CURRENT_DIR, 'bench_baseline.json')
+CHECKSUMS = os.path.join(CURRENT_DIR, 'sample_checksums.json')
+# Fraction of the baseline throughput that can be lost before a run fails
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_PAGES = 4
+DEFAULT_REPEAT = 3
+# Conversions quicker than this are not compared, they are mostly noise and start up
+MIN_SECONDS = 0.1
+
+def _parse_file(**kwargs):
+    def convert(lid_filename, ori_fh, temp_fh):
+        mat.parse_file(lid_filename, ori_fh, temp_fh, **kwargs)
+    return convert
+
+def _parse_file_only(lid_filename, ori_fh, temp_fh):
+    '''Convert each csv on its own, projected to its sensors'''
+    mat.parse_file(lid_filename, io.StringIO(), temp_fh, only='temp')
+    mat.parse_file(lid_filename, ori_fh, io.StringIO(), only='ori')
+
+def _convert_segments(lid_filename, ori_fh, temp_fh):
+    '''Convert with segments.convert_file, one data page per segment'''
+    directory = tempfile.mkdtemp()
+    try:
+        filenames = [os.path.join(directory, name) for name in ('ori.csv', 'tmp.csv')]
+        segments.convert_file(lid_filename, *filenames, workers=2, segment_pages=1)
+        for filename, fh in zip(filenames, (ori_fh, temp_fh)):
+            with open(filename, newline='') as csv:
+                fh.write(csv.read())
+    finally:
+        shutil.rmtree(directory)
+
+# name: convert(lid_filename, ori_fh, temp_fh), the first one is the reference
+ENGINES = collections.OrderedDict([
+    ('sequential', _parse_file()),
+    ('small queues', _parse_file(queue_depth=1)),
+    ('workers', _parse_file(workers=2)),
+    ('only', _parse_file_only),
+    ('segments', _convert_segments),
+])
+
+def sample_lids():
+    '''Return every lid file under samples/'''
+    return sorted(glob.glob(os.path.join(SAMPLES_DIR, '*', '*.lid')))
+
+def make_synthetic_lid(lid_filename, filename, pages):
+    '''Write a lid file of the given number of data pages out of the first page of another
+
+    The data of the first page is repeated to fill every page, each page
+    starts where the readings of the one before end and the last one is cut
+    short.
+    '''
+    with open(lid_filename, 'rb') as lid:
+        header = lid.read(mat.MAIN_HEADER_SIZE)
+        first_page = lid.read(mat.DATA_PAGE_SIZE)
+    _, mini_header, _, mh_size = mat.parse_main_header(header)
+    layout = mat.get_page_layout(mini_header)
+    data = first_page[mh_size:]
+    erased = data.find(b'\xff' * 14)
+    if erased > -1:
+        data = data[:erased]
+    data = data[:len(data) - len(data) % layout.p_size]
+    body = (data * (mat.DATA_PAGE_SIZE // len(data) + 1))[:mat.DATA_PAGE_SIZE - mh_size]
+    clk = mat.page_clock(first_page, mh_size)
+    # A pattern takes TRI seconds, or ORI when that is longer, like the page decoder counts
+    pattern_delta = layout.tmp_delta if layout.tri >= layout.ori else layout.ori_delta
+    page_delta = pattern_delta * int(math.ceil(len(body) / layout.p_size))
+    old_clk = clk.strftime(mat.CLOCK_FORMAT).encode('ascii')
+    with open(filename, 'wb') as fh:
+        fh.write(header)
+        for page_number in range(pages):
+            new_clk = clk.strftime(mat.CLOCK_FORMAT).encode('ascii')
+            page = first_page[:mh_size].replace(old_clk, new_clk, 1) + body
+            if page_number == pages - 1:
+                page = page[:len(page) // 3]
+            fh.write(page)
+            clk += page_delta
+
+def convert(engine, lid_filename):
+    '''Return the (orientation, temperature) csv and the seconds it took the engine'''
+    ori = io.StringIO()
+    tmp = io.StringIO()
+    start = time.time()
+    ENGINES[engine](lid_filename, ori, tmp)
+    return (ori.getvalue(), tmp.getvalue()), time.time() - start
+
+def checksum(output):
+    '''sha256 of both csv files, the same whatever the line separator'''
+    digest = hashlib.sha256()
+    for text in output:
+        digest.update(text.replace(os.linesep, '\n').encode('ascii'))
+    return digest.hexdigest()
+
+def compare_frame(lid_filename, output):
+    '''Return the problems of the csv output compared to the DataFrame of read_lid
+
+    read_lid calibrates the readings with numpy instead of the lookup tables
+    of the csv engines. Every csv value has to be within rounding of the
+    float32 read_lid has, at a time within the 100 microseconds the csv shows.
+    Returns no problems if numpy or pandas is not installed.
+    '''
+    try:
+        import numpy as np
+        import pandas as pd
+    except ImportError:
+        return []
+    from matp.frame import read_lid
+    name = os.path.basename(lid_filename)
+    problems = []
+    for text in output:
+        expected = pd.read_csv(io.StringIO(text), dtype={'Date': str, 'Time': str})
+        columns = list(expected.columns[2:])
+        if not columns or not len(expected):
+            # Sensor not in the file
+            continue
+        first_row = text.split(os.linesep, 2)[1].split(',')
+        frame = read_lid(lid_filename, columns=columns)
+        if len(frame) != len(expected):
+            problems.append('%s: read_lid has %d rows of %s, the csv %d'
+                            % (name, len(frame), columns[0], len(expected)))
+            continue
+        times = pd.to_datetime(expected['Date'] + ' ' + expected['Time'],
+                               format='%Y-%m-%d %H:%M:%S.%f').values
+        late = np.abs(frame.index.values - times) >= np.timedelta64(100, 'us')
+        if late.any():
+            problems.append('%s: %d %s times differ from read_lid'
+                            % (name, late.sum(), columns[0]))
+        for column in columns:
+            got = frame[column].values.astype(float)
+            want = expected[column].values
+            # Half of the last digit the csv shows, and float32 rounding
+            decimals = len(first_row[2 + columns.index(column)].split('.')[1])
+            close = np.isclose(got, want, rtol=1e-7, atol=0.5 * 10.0 ** -decimals)
+            # read_lid has no value for a thermometer reading of 0, the csv writes 0
+            close |= np.isnan(got) & (want == 0)
+            if not close.all():
+                problems.append('%s: %d %s values differ from read_lid'
+                                % (name, (~close).sum(), column))
+    return problems
+
+def run(lid_filenames, repeat=DEFAULT_REPEAT, log=None):
+    '''Convert every file with every engine, return (results, problems)
+
+    results is {file name: {'sha256': ..., 'seconds': {engine: ...},
+    'mb_per_second': {engine: ...}}}, the time is the best of repeat runs, after
+    a first run of the reference to build the lookup tables. problems lists
+    every engine whose output is not the same as the reference, and every
+    difference between the reference and read_lid (see compare_frame).
+    '''
+    reference = next(iter(ENGINES))
+    results = collections.OrderedDict()
+    problems = []
+    for lid_filename in lid_filenames:
+        name = os.path.basename(lid_filename)
+        megabytes = os.path.getsize(lid_filename) / 1e6
+        expected, _ = convert(reference, lid_filename)
+        problems.extend(compare_frame(lid_filename, expected))
+        times = collections.OrderedDict()
+        speeds = collections.OrderedDict()
+        for engine in ENGINES:
+            for i in range(repeat):
+                output, seconds = convert(engine, lid_filename)
+                times[engine] = min(seconds, times.get(engine, seconds))
+                if output != expected:
+                    problems.append('%s: %s output is not the same as %s'
+                                    % (name, engine, reference))
+                    break
+            speeds[engine] = megabytes / max(times[engine], 1e-9)
+            if log:
+                log('%-24s %-14s %8.3fs %8.2f MB/s' % (name, engine, times[engine], speeds[engine]))
+        results[name] = {'sha256': checksum(expected), 'seconds': times, 'mb_per_second': speeds}
+    return results, problems
+
+def load_checksums(filename=CHECKSUMS):
+    '''Return the committed {file name: sha256} of the reference outputs'''
+    with open(filename) as fh:
+        return json.load(fh)
+
+def check_checksums(results, checksums):
+    '''Return a problem for every file whose output is not the one of its checksum'''
+    return ['%s: output is not the one in %s' % (name, os.path.basename(CHECKSUMS))
+            for name, result in results.items()
+            if name in checksums and result['sha256'] != checksums[name]]
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    '''Return the throughput problems of results compared to the timing baseline'''
+    problems = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        for engine, speed in result['mb_per_second'].items():
+            if expected['seconds'].get(engine, 0) < MIN_SECONDS:
+                continue
+            before = expected['mb_per_second'][engine]
+            if speed < before * (1 - threshold):
+                problems.append('%s: %s got %.0f%% slower (%.2f MB/s, was %.2f MB/s)'
+                                % (name, engine, 100 * (1 - speed / before), speed, before))
+    return problems
+
+def bench(pages=DEFAULT_PAGES, repeat=DEFAULT_REPEAT, log=None):
+    '''Run every sample and a synthetic copy of each with this many pages
+
+    Returns (results, problems) like run, with the checksums checked too.
+    '''
+    directory = tempfile.mkdtemp()
+    try:
+        lid_filenames = sample_lids()
+        for lid_filename in list(lid_filenames):
+            name = os.path.splitext(os.path.basename(lid_filename))[0]
+            synthetic = os.path.join(directory, '%s_x%d.lid' % (name, pages))
+            make_synthetic_lid(lid_filename, synthetic, pages)
+            lid_filenames.append(synthetic)
+        results, problems = run(lid_filenames, repeat=repeat, log=log)
+        return results, problems + check_checksums(results, load_checksums())
+    finally:
+        shutil.rmtree(directory)
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--record', action='store_true',
+                        help='write the timings to the baseline instead of checking them')
+    parser.add_argument('--record-checksums', action='store_true',
+                        help='write the output checksums to %s, when the output is meant '
+                             'to change' % os.path.basename(CHECKSUMS))
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='baseline json file (default %(default)s)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fraction of throughput that can be lost (default %(default)s)')
+    parser.add_argument('--pages', type=int, default=DEFAULT_PAGES,
+                        help='data pages of the synthetic files (default %(default)s)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='conversions per file and engine, the fastest counts '
+                             '(default %(default)s)')
+    args = parser.parse_args()
+
+    results, problems = bench(pages=args.pages, repeat=args.repeat, log=print)
+    if args.record_checksums:
+        checksums = collections.OrderedDict(
+            (name, result['sha256']) for name, result in results.items())
+        with open(CHECKSUMS, 'w') as fh:
+            json.dump(checksums, fh, indent=2)
+            fh.write('\n')
+        print('checksums written to %s' % CHECKSUMS)
+        problems = [problem for problem in problems if not problem.endswith(
+            os.path.basename(CHECKSUMS))]
+    if args.record:
+        timings = collections.OrderedDict(
+            (name, {'seconds': result['seconds'], 'mb_per_second': result['mb_per_second']})
+            for name, result in results.items())
+        with open(args.baseline, 'w') as fh:
+            json.dump(timings, fh, indent=2)
+        print('baseline written to %s' % args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            problems.extend(compare(results, json.load(fh), threshold=args.threshold))
+    else:
+        print('no baseline at %s, run with --record to write one' % args.baseline)
+    for problem in problems:
+        print('FAIL %s' % problem)
+    if problems:
+        sys.exit(1)
+    print('OK')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import unittest
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from matp import mat
+from matp import fleet
+from matp.test import bench
+from matp.test.test_mat import TimerTestCase, SAMPLES_DIR, convert
+
+LIDS = [
+    os.path.join(SAMPLES_DIR, 'sample1', 's1_1-60-2-2.lid'),
+    os.path.join(SAMPLES_DIR, 'sample2', 's2_1-60-2-2.lid'),
+    os.path.join(SAMPLES_DIR, 'sample3', 's3_5_60_4_20.lid'),
+]
+
+def with_logger(text, logger):
+    '''Return the rows of a csv from parse_file with the logger id added after the time'''
+    return [row[:fleet.TIMESTAMP_LENGTH] + ',' + logger + row[fleet.TIMESTAMP_LENGTH:]
+            for row in text.splitlines(True)[1:]]
+
+class ExportFleetTestCase(TimerTestCase):
+    def export(self, lid_filenames, **kwargs):
+        ori = StringIO()
+        tmp = StringIO()
+        fleet.export_fleet(lid_filenames, ori, tmp, **kwargs)
+        return ori.getvalue(), tmp.getvalue()
+
+    def test_one_file(self):
+        '''a single file should come out like parse_file with a Logger column'''
+        lid = os.path.join(SAMPLES_DIR, 'sample5', 's5_5-10-64-320.lid')
+        ori, tmp = convert(lid)
+        merged_ori, merged_tmp = self.export([lid])
+        self.assertEqual(merged_tmp.splitlines(True)[0],
+                         'Date,Time,Logger,Temperature (C)' + os.linesep)
+        self.assertEqual(merged_tmp.splitlines(True)[1:], with_logger(tmp, 'Board_L'))
+        self.assertEqual(merged_ori.splitlines(True)[1:], with_logger(ori, 'Board_L'))
+
+    def test_merged_by_time(self):
+        '''every row of every file should be there once, in time order'''
+        merged = self.export(LIDS)
+        expected = [[], []]
+        for lid in LIDS:
+            for i, text in enumerate(convert(lid)):
+                expected[i].extend(with_logger(text, '1308026'))
+        for text, rows in zip(merged, expected):
+            merged_rows = text.splitlines(True)[1:]
+            self.assertCountEqual(merged_rows, rows)
+            times = [row[:fleet.TIMESTAMP_LENGTH] for row in merged_rows]
+            self.assertEqual(times, sorted(times))
+
+    def test_worker_pool(self):
+        '''decoding in worker processes should give the same output'''
+        self.assertEqual(self.export(LIDS, workers=2, queue_depth=1), self.export(LIDS))
+
+    def test_only(self):
+        ori, tmp = self.export(LIDS)
+        self.assertEqual(self.export(LIDS, only='temp'), ('Date,Time,Logger' + os.linesep, tmp))
+
+    def test_different_columns(self):
+        '''files without the same sensors can not be merged'''
+        directory = tempfile.mkdtemp()
+        try:
+            with open(LIDS[0], 'rb') as fh:
+                data = fh.read()
+            header = data[:mat.MAIN_HEADER_SIZE].replace(b'ACL 1', b'ACL 0', 1)
+            lid = os.path.join(directory, 'no_acl.lid')
+            with open(lid, 'wb') as fh:
+                fh.write(header + data[mat.MAIN_HEADER_SIZE:])
+            self.assertRaises(ValueError, fleet.merge_files, [LIDS[0], lid], StringIO(), only='ori')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_more_files_than_decoders(self):
+        '''every file should keep its decoder for the whole merge'''
+        directory = tempfile.mkdtemp()
+        get_page_decoder = mat.get_page_decoder
+        default_size = fleet.DECODER_CACHE_SIZE
+        builds = []
+        def counting_get_page_decoder(*args, **kwargs):
+            builds.append(args)
+            return get_page_decoder(*args, **kwargs)
+        try:
+            lids = []
+            for i in range(3):
+                lid = os.path.join(directory, 'logger%d.lid' % i)
+                bench.make_synthetic_lid(LIDS[0], lid, 2)
+                lids.append(lid)
+            fleet.DECODER_CACHE_SIZE = 1
+            fleet.set_decoder_cache_size(1)
+            mat.get_page_decoder = counting_get_page_decoder
+            fleet.merge_files(lids, StringIO(), only='temp')
+            self.assertEqual(len(builds), len(lids))
+            self.assertEqual(fleet.set_decoder_cache_size(1), 1)
+        finally:
+            mat.get_page_decoder = get_page_decoder
+            fleet.DECODER_CACHE_SIZE = default_size
+            fleet.set_decoder_cache_size(default_size)
+            shutil.rmtree(directory)
+
+    def test_logger_id(self):
+        self.assertEqual(fleet.logger_id('a/b/site3.lid', {'SER': '1308026'}), '1308026')
+        self.assertEqual(fleet.logger_id('a/b/site3.lid', {}), 'site3')
+
+
+if __name__ == '__main__':
+    unittest.main()
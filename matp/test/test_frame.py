@@ -0,0 +1,116 @@
+import unittest
+import os
+import datetime
+import shutil
+import tempfile
+
+from matp import mat
+from matp.test import bench
+from matp.test.test_mat import TimerTestCase, SAMPLES_DIR, convert
+
+try:
+    import numpy
+    import pandas
+except ImportError:
+    pandas = None
+
+if pandas is not None:
+    from matp import frame
+
+LIDS = [
+    os.path.join(SAMPLES_DIR, 'sample1', 's1_1-60-2-2.lid'),
+    os.path.join(SAMPLES_DIR, 'sample3', 's3_5_60_4_20.lid'),
+    os.path.join(SAMPLES_DIR, 'sample5', 's5_5-10-64-320.lid'),
+]
+
+def csv_rows(text):
+    '''Return the (time, values) of every row of a csv written by parse_file'''
+    rows = []
+    for line in text.splitlines()[1:]:
+        fields = line.split(',')
+        time = datetime.datetime.strptime(fields[0] + ' ' + fields[1], '%Y-%m-%d %H:%M:%S.%f')
+        rows.append((time, [float(field) for field in fields[2:]]))
+    return rows
+
+@unittest.skipIf(pandas is None, 'pandas is not installed')
+class ReadLidTestCase(TimerTestCase):
+    def setUp(self):
+        super(ReadLidTestCase, self).setUp()
+        self.lid = LIDS[-1]
+
+    def assertMatchesCsv(self, df, text, columns):
+        '''the non NaN rows of the columns should be the rows of the csv'''
+        expected = csv_rows(text)
+        values = df[columns].dropna()
+        self.assertEqual(len(values), len(expected))
+        for (time, row), (index, actual) in zip(expected, values.iterrows()):
+            self.assertLess(abs(index.to_pydatetime() - time), datetime.timedelta(microseconds=100))
+            for a, b in zip(actual, row):
+                self.assertAlmostEqual(a, b, delta=1e-4 * max(1, abs(b)))
+
+    def test_matches_csv(self):
+        '''every reading should be in the DataFrame with the value of the csv'''
+        for lid in LIDS:
+            ori, tmp = convert(lid)
+            df = frame.read_lid(lid)
+            self.assertEqual(df.index.name, 'Time')
+            self.assertTrue(df.index.is_monotonic_increasing)
+            self.assertMatchesCsv(df, tmp, [mat.TEMPERATURE_COLUMN])
+            self.assertMatchesCsv(df, ori, list(mat.ACCELEROMETER_COLUMNS + mat.MAGNETOMETER_COLUMNS))
+
+    def test_dtypes(self):
+        df = frame.read_lid(self.lid)
+        self.assertEqual(list(df.columns), [mat.TEMPERATURE_COLUMN] + list(mat.ACCELEROMETER_COLUMNS)
+                         + list(mat.MAGNETOMETER_COLUMNS))
+        for dtype in df.dtypes:
+            self.assertEqual(dtype, numpy.float32)
+
+    def test_columns(self):
+        '''only the requested columns should be read'''
+        df = frame.read_lid(self.lid, columns=['Az (g)', mat.TEMPERATURE_COLUMN])
+        self.assertEqual(list(df.columns), [mat.TEMPERATURE_COLUMN, 'Az (g)'])
+        ori, tmp = convert(self.lid)
+        self.assertMatchesCsv(df, tmp, [mat.TEMPERATURE_COLUMN])
+        temperatures = frame.read_lid(self.lid, columns=[mat.TEMPERATURE_COLUMN])
+        self.assertEqual(len(temperatures), len(tmp.splitlines()) - 1)
+        self.assertRaises(ValueError, frame.read_lid, self.lid, columns=['Pressure'])
+
+    def test_chunks(self):
+        '''the chunks put together should be the whole file'''
+        df = frame.read_lid(self.lid)
+        chunks = list(frame.read_lid(self.lid, chunksize=1))
+        self.assertEqual(len(chunks), mat.count_data_pages(self.lid))
+        pandas.testing.assert_frame_equal(pandas.concat(chunks), df)
+
+    def test_chunks_across_pages(self):
+        '''chunks should be the whole file when both sensors cross page boundaries'''
+        directory = tempfile.mkdtemp()
+        try:
+            lid = os.path.join(directory, 'synthetic.lid')
+            bench.make_synthetic_lid(LIDS[1], lid, 3)
+            df = frame.read_lid(lid)
+            for chunksize in (1, 2):
+                pandas.testing.assert_frame_equal(
+                    pandas.concat(frame.read_lid(lid, chunksize=chunksize)), df)
+            # Every reading is one row, none is repeated or lost
+            temperatures = df[mat.TEMPERATURE_COLUMN].notna().sum()
+            orientations = df[mat.ACCELEROMETER_COLUMNS[0]].notna().sum()
+            self.assertEqual(temperatures + orientations, len(df))
+            self.assertEqual(temperatures, len(frame.read_lid(lid, columns=[mat.TEMPERATURE_COLUMN])))
+            self.assertTrue(df.index.is_monotonic_increasing)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_start_end(self):
+        '''start and end should both be included'''
+        df = frame.read_lid(self.lid)
+        start, end = df.index[len(df) // 3], df.index[2 * len(df) // 3]
+        between = frame.read_lid(self.lid, start=start, end=end)
+        pandas.testing.assert_frame_equal(between, df.loc[start:end])
+        self.assertEqual(between.index[0], start)
+        self.assertEqual(between.index[-1], end)
+        self.assertEqual(len(frame.read_lid(self.lid, start=df.index[-1] + pandas.Timedelta('1s'))), 0)
+
+    def test_package_export(self):
+        import matp
+        self.assertIs(matp.read_lid, frame.read_lid)
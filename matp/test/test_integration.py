@@ -1,6 +1,6 @@
 import os
 import datetime
-import StringIO
+import io
 
 from matp import mat
 
@@ -38,12 +38,12 @@ def get_expected_files(directory):
 def parse_file(lidfile):
     '''returns the output of matp
 
-    >>> t = StringIO.StringIO()
-    >>> o = StringIO.StringIO()
+    >>> t = io.StringIO()
+    >>> o = io.StringIO()
     >>> mat.parse_file('samples/sample1/s1_1-60-2-2.lid', t, o, default_host_storage=False)
     '''
-    t = StringIO.StringIO()
-    o = StringIO.StringIO()
+    t = io.StringIO()
+    o = io.StringIO()
     mat.parse_file(lidfile, o, t, default_host_storage=False)
     return (t.getvalue().strip().split(os.linesep), o.getvalue().strip().split(os.linesep))
 
@@ -100,7 +100,7 @@ def compare_lines(actual_lines, expected_lines):
         return False
     if len(actual_lines) != len(expected_lines):
         return False
-    linenos = 1, len(actual_lines)/2, -1
+    linenos = 1, len(actual_lines)//2, -1
     same = True
     for i in linenos:
         if not compare_data_lines(actual_lines[i], expected_lines[i]):
@@ -116,6 +116,9 @@ def main():
     current_dir = os.path.dirname(os.path.realpath(__file__))
     samples_dir = os.path.join(current_dir, 'samples')
     for directory in find_sample_dirs(samples_dir):
+        if not any(name.endswith('.lid') for name in os.listdir(directory)):
+            print("=== {}: no lid file, skipped ===".format(directory))
+            continue
         lidfile = get_file_with_ending(directory, '.lid')
         print("=== {} ===".format(lidfile))
         t, o = parse_file(lidfile)
@@ -1,6 +1,11 @@
 import unittest
 import time
 import os
+import binascii
+import struct
+import shutil
+import tempfile
+from io import StringIO
 
 from matp import mat
 
@@ -10,7 +15,7 @@ class TimerTestCase(unittest.TestCase):
     
     def tearDown(self):
         t = time.time() - self.start
-        print "%s: %.3f" % (self.id(), t)
+        print("%s: %.3f" % (self.id(), t))
 
 class PatternTestCase(TimerTestCase):
     def setUp(self):
@@ -203,7 +208,7 @@ class GetOriCSVHeadersTestCase(TimerTestCase):
 class HSSTestCase(TimerTestCase):
     def setUp(self):
         super(HSSTestCase, self).setUp()
-        self.hss = '4844530d0a53455220313330383032360d0a46575620312e302e3131365f41564733320d0a44504c203130340d0a444653203078383030300d0a53544d20313937302d30312d30312030303a30303a30300d0a45544d20343039362d30312d30312030303a30303a30300d0a4c454420310d0a4d48530d0a434c4b20323031332d31312d31352030393a30353a33380d0a544d5020310d0a41434c20310d0a4d474e20310d0a54524920310d0a4f52492036300d0a424d5220320d0a424d4e20320d0a42415420306536650d0a53545320303030310d0a4d48450d0a4844450d0a48535352564e3130544d4f3130544d52353130303030544d4146302e30303131323338313030333534544d4246302e30303032333439343537303733544d4346302e303030303030303834383336314158413130415842343130323441594131304159423431303234415a413130415a4234313032344d584131304d594131304d5a4131304d585331314d595331314d5a533131485345ffffffffffffff'.decode('hex')
+        self.hss = bytes.fromhex('4844530d0a53455220313330383032360d0a46575620312e302e3131365f41564733320d0a44504c203130340d0a444653203078383030300d0a53544d20313937302d30312d30312030303a30303a30300d0a45544d20343039362d30312d30312030303a30303a30300d0a4c454420310d0a4d48530d0a434c4b20323031332d31312d31352030393a30353a33380d0a544d5020310d0a41434c20310d0a4d474e20310d0a54524920310d0a4f52492036300d0a424d5220320d0a424d4e20320d0a42415420306536650d0a53545320303030310d0a4d48450d0a4844450d0a48535352564e3130544d4f3130544d52353130303030544d4146302e30303131323338313030333534544d4246302e30303032333439343537303733544d4346302e303030303030303834383336314158413130415842343130323441594131304159423431303234415a413130415a4234313032344d584131304d594131304d5a4131304d585331314d595331314d5a533131485345ffffffffffffff')
         
     def test_clean_hss(self):
         '''Clean hss should return a string that starts with HSS and ends with HSE'''
@@ -220,18 +225,18 @@ class HSSTestCase(TimerTestCase):
 class ParseMainHeaderTestCase(TimerTestCase):
     def setUp(self):
         super(ParseMainHeaderTestCase, self).setUp()
-        self.header = '4844530d0a53455220313330383032360d0a46575620312e302e3131365f41564733320d0a44504c203130340d0a444653203078383030300d0a53544d20313937302d30312d30312030303a30303a30300d0a45544d20343039362d30312d30312030303a30303a30300d0a4c454420310d0a4d48530d0a434c4b20323031332d31312d31352030393a30353a33380d0a544d5020310d0a41434c20310d0a4d474e20310d0a54524920310d0a4f52492036300d0a424d5220320d0a424d4e20320d0a42415420306536650d0a53545320303030310d0a4d48450d0a4844450d0a48535352564e3130544d4f3130544d52353130303030544d4146302e30303131323338313030333534544d4246302e30303032333439343537303733544d4346302e303030303030303834383336314158413130415842343130323441594131304159423431303234415a413130415a4234313032344d584131304d594131304d5a4131304d585331314d595331314d5a533131485345ffffffffffffff'.decode('hex')
+        self.header = bytes.fromhex('4844530d0a53455220313330383032360d0a46575620312e302e3131365f41564733320d0a44504c203130340d0a444653203078383030300d0a53544d20313937302d30312d30312030303a30303a30300d0a45544d20343039362d30312d30312030303a30303a30300d0a4c454420310d0a4d48530d0a434c4b20323031332d31312d31352030393a30353a33380d0a544d5020310d0a41434c20310d0a4d474e20310d0a54524920310d0a4f52492036300d0a424d5220320d0a424d4e20320d0a42415420306536650d0a53545320303030310d0a4d48450d0a4844450d0a48535352564e3130544d4f3130544d52353130303030544d4146302e30303131323338313030333534544d4246302e30303032333439343537303733544d4346302e303030303030303834383336314158413130415842343130323441594131304159423431303234415a413130415a4234313032344d584131304d594131304d5a4131304d585331314d595331314d5a533131485345ffffffffffffff')
 
     def test_header_parsing(self):
         header, mini_header, hss, mh_size = mat.parse_main_header(self.header)
-        self.assertItemsEqual(header, {'LED': '1', 
+        self.assertCountEqual(header, {'LED': '1', 
                                        'SER': '0004', 
                                        'STM': '1970-01-01 00:00:00', 
                                        'DFS': '0x8000', 
                                        'FWV': '1.0.098', 
                                        'DPL': '1', 
                                        'ETM': '4096-01-01 00:00:00'})
-        self.assertItemsEqual(mini_header, {'TMP': '1', 
+        self.assertCountEqual(mini_header, {'TMP': '1', 
                                             'TRI': '60', 
                                             'BAT': '0e70', 
                                             'CLK': '2013-07-30 11:45:03', 
@@ -241,7 +246,7 @@ class ParseMainHeaderTestCase(TimerTestCase):
                                             'ACL': '1', 
                                             'BMR': '16', 
                                             'ORI': '60'})
-        self.assertItemsEqual(hss, {'TMR': '10000', 
+        self.assertCountEqual(hss, {'TMR': '10000', 
                                     'MZS': '1', 
                                     'TMC': '0.0000000848361', 
                                     'AZA': '0', 
@@ -262,8 +267,44 @@ class ParseMainHeaderTestCase(TimerTestCase):
         self.assertEqual(mh_size, 105)
 
     def test_no_hss_tag(self):
-        hss = mat.parse_hss('blahblahblah'.encode('hex'))
-        self.assertItemsEqual(hss, mat.DEFAULT_HOST_STORAGE)
+        hss = mat.parse_hss(binascii.hexlify(b'blahblahblah'))
+        self.assertCountEqual(hss, mat.DEFAULT_HOST_STORAGE)
+
+    def test_values(self):
+        '''values should come out of the single pass like out of parse_header'''
+        header, mini_header, hss, mh_size = mat.parse_main_header(self.header)
+        self.assertEqual(header['SER'], '1308026')
+        self.assertEqual(mini_header['CLK'], '2013-11-15 09:05:38')
+        start = self.header.find(b'MHS')
+        self.assertEqual(mini_header, mat.parse_header(self.header[start:start + mh_size]))
+        self.assertEqual(hss['TMR'], 10000)
+        self.assertEqual(hss['TMA'], 0.0011238100354)
+        self.assertEqual(hss['RVN'], '0')
+
+    def test_scan_header(self):
+        lines = b'MHS\r\nCLK 2013-11-15 09:05:38\r\nTMP 1'
+        self.assertEqual(list(mat.scan_header(lines)), [(0, 3, -1), (5, 28, 8), (30, 35, 33)])
+        self.assertEqual(list(mat.scan_header(lines, 5, 28)), [(5, 28, 8)])
+
+class PageClockTestCase(TimerTestCase):
+    def setUp(self):
+        super(PageClockTestCase, self).setUp()
+        self.mini_header = b'MHS\r\nCLK 2013-11-15 09:05:38\r\nTMP 1\r\nMHE\r\n'
+
+    def test_clock(self):
+        clk = mat.page_clock(self.mini_header + b'\x00' * 10, len(self.mini_header))
+        self.assertEqual(clk, mat.datetime.datetime(2013, 11, 15, 9, 5, 38))
+
+    def test_clock_not_first(self):
+        '''a CLK anywhere else in the mini header should still be found'''
+        mini_header = b'MHS\r\nTMP 1\r\nCLK 2013-11-15 09:05:38\r\nMHE\r\n'
+        clk = mat.page_clock(mini_header, len(mini_header))
+        self.assertEqual(clk, mat.datetime.datetime(2013, 11, 15, 9, 5, 38))
+
+    def test_bad_clock(self):
+        for clk in (b'2013-13-15 09:05:38', b'2013/11/15 09:05:38'):
+            mini_header = self.mini_header.replace(b'2013-11-15 09:05:38', clk)
+            self.assertRaises(ValueError, mat.page_clock, mini_header, len(mini_header))
 
 class TestBuildAccelerometerValues(TimerTestCase):
     def setUp(self):
@@ -302,6 +343,156 @@ class TestBuildThermometerValues(TimerTestCase):
         t = mat.build_thermometer_values(h['TMA'], h['TMB'], h['TMC'], h['TMO'], h['TMR'])
         self.assertEqual(len(t), 2**16 - 1)
 
+class TestLookupTable(TimerTestCase):
+    def setUp(self):
+        super(TestLookupTable, self).setUp()
+        self.table = mat.LookupTable(['-1.5', '0.0', '12.25'], first=-1)
+
+    def test_values(self):
+        '''every reading should give back its value without padding'''
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(self.table[-1], '-1.5')
+        self.assertEqual(self.table[0], '0.0')
+        self.assertEqual(self.table[1], '12.25')
+
+    def test_one_buffer(self):
+        '''values are stored in one fixed width buffer'''
+        self.assertEqual(self.table.width, 5)
+        self.assertEqual(self.table.buffer, b' -1.5  0.012.25')
+
+    def test_out_of_range(self):
+        self.assertRaises(IndexError, lambda: self.table[2])
+        self.assertRaises(IndexError, lambda: self.table[-2])
+
+    def test_share(self):
+        '''a shared table should have the same values'''
+        shared = self.table.share()
+        self.assertEqual(shared.buffer[:], self.table.buffer)
+        self.assertEqual(shared[1], '12.25')
+
+class TestGetLookupTables(TimerTestCase):
+    def setUp(self):
+        super(TestGetLookupTables, self).setUp()
+        h = mat.DEFAULT_HOST_STORAGE
+        self.calibration = (h['AXA'], h['AXB'], h['MXA'], h['MXS'],
+                            h['TMA'], h['TMB'], h['TMC'], h['TMO'], h['TMR'])
+
+    def test_only_enabled_sensors(self):
+        '''tables of disabled sensors should not be built'''
+        accels, magnes, temps = mat.get_lookup_tables(*self.calibration, acl=False, mgn=False)
+        self.assertIsNone(accels)
+        self.assertIsNone(magnes)
+        self.assertEqual(len(temps), 2**16 - 1)
+
+    def test_cached(self):
+        '''the same calibration should reuse the same tables'''
+        first = mat.get_lookup_tables(*self.calibration)
+        second = mat.get_lookup_tables(*self.calibration)
+        for a, b in zip(first, second):
+            self.assertIs(a, b)
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'samples')
+
+def convert(lid_filename, **kwargs):
+    '''Run parse_file and return the orientation and temperature output'''
+    ori = StringIO()
+    tmp = StringIO()
+    mat.parse_file(lid_filename, ori, tmp, **kwargs)
+    return ori.getvalue(), tmp.getvalue()
+
+class ParseFilePipelineTestCase(TimerTestCase):
+    def setUp(self):
+        super(ParseFilePipelineTestCase, self).setUp()
+        self.lid = os.path.join(SAMPLES_DIR, 'sample5', 's5_5-10-64-320.lid')
+        self.expected = convert(self.lid)
+
+    def test_starts_with_headers(self):
+        '''both outputs should start with their csv headers'''
+        ori, tmp = self.expected
+        self.assertTrue(ori.startswith(mat.get_ori_csv_headers()))
+        self.assertTrue(tmp.startswith(mat.get_tmp_csv_headers()))
+
+    def test_small_queues(self):
+        '''a queue depth of one should give the same output'''
+        self.assertEqual(convert(self.lid, queue_depth=1), self.expected)
+
+    def test_unbounded_queues(self):
+        '''queues without a limit should be refused'''
+        for queue_depth in (0, -1):
+            self.assertRaises(ValueError, convert, self.lid, queue_depth=queue_depth)
+            self.assertRaises(ValueError, mat.positive_int, str(queue_depth))
+        self.assertEqual(mat.positive_int('3'), 3)
+
+    def test_worker_pool(self):
+        '''decoding in worker processes should give the same output'''
+        self.assertEqual(convert(self.lid, workers=2, queue_depth=2), self.expected)
+
+    def test_writer_error(self):
+        '''an error while writing should be raised instead of hanging the pipeline'''
+        class BrokenFile(object):
+            '''Takes the csv header and then runs out of space'''
+            writes = 0
+            def write(self, data):
+                self.writes += 1
+                if self.writes > 1:
+                    raise IOError('disk full')
+        ori = StringIO()
+        self.assertRaises(IOError, mat.parse_file, self.lid, ori, BrokenFile())
+
+    def test_only(self):
+        '''only should convert one csv exactly as before and leave the other one empty'''
+        ori, tmp = self.expected
+        self.assertEqual(convert(self.lid, only='temp'), ('Date,Time' + os.linesep, tmp))
+        self.assertEqual(convert(self.lid, only='ori'), (ori, 'Date,Time' + os.linesep))
+        self.assertEqual(convert(self.lid, only='temp', workers=2)[1], tmp)
+        self.assertRaises(ValueError, convert, self.lid, only='pressure')
+
+    def test_bytes_decoder(self):
+        '''a decoder with as_bytes should give the same text as ASCII bytes'''
+        with open(self.lid, 'rb') as fh:
+            _, mini_header, hss, mh_size = mat.parse_main_header(fh.read(mat.MAIN_HEADER_SIZE))
+            data_page = fh.read(mat.DATA_PAGE_SIZE)
+        text = mat.get_page_decoder(mini_header, hss, mh_size)(data_page)
+        data = mat.get_page_decoder(mini_header, hss, mh_size, as_bytes=True)(data_page)
+        self.assertEqual(data, tuple(t.encode('ascii') for t in text))
+
+    def test_invalid_temperature(self):
+        '''0xFFFF has no temperature, it should raise instead of writing an empty value'''
+        with open(self.lid, 'rb') as fh:
+            data = fh.read()
+        _, _, _, mh_size = mat.parse_main_header(data[:mat.MAIN_HEADER_SIZE])
+        first_temperature = mat.MAIN_HEADER_SIZE + mh_size
+        directory = tempfile.mkdtemp()
+        try:
+            lid = os.path.join(directory, 'invalid.lid')
+            with open(lid, 'wb') as fh:
+                fh.write(data[:first_temperature] + b'\xff\xff' + data[first_temperature + 2:])
+            self.assertRaises(IndexError, convert, lid)
+            self.assertRaises(IndexError, convert, lid, workers=2)
+        finally:
+            shutil.rmtree(directory)
+
+class ProjectPatternTestCase(TimerTestCase):
+    def test_project_pattern(self):
+        self.assertEqual(mat.project_pattern('<H1920h59H', orientation=False), '<H3840x59H')
+        self.assertEqual(mat.project_pattern('<H1920h59H', tmp=False), '<2x1920h118x')
+        self.assertEqual(mat.project_pattern('<H12h'), '<H12h')
+
+    def test_unpack_only_some_readings(self):
+        '''skipping readings should give the same readings that are kept'''
+        for tri, ori in ((5, 60), (60, 5), (1, 1)):
+            p = mat.pattern(2, ori=ori, tri=tri)
+            p_size = struct.calcsize(p)
+            words = p_size // 2
+            # three complete patterns and a partial one, when the pattern allows it
+            data = struct.pack('<%dH' % (words * 4), *range(1, words * 4 + 1))[:-2]
+            kwargs = dict(patterns_in_page=4, p=p, p_size=p_size, bmn=2, tri=tri, ori=ori)
+            everything = list(mat.unpack_patterns(data, **kwargs))
+            temperatures = list(mat.unpack_patterns(data, orientation=False, **kwargs))
+            orientations = list(mat.unpack_patterns(data, tmp=False, **kwargs))
+            self.assertEqual(temperatures, [(t, ()) for t, o in everything])
+            self.assertEqual(orientations, [((), o) for t, o in everything])
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().discover('.')
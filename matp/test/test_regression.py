@@ -0,0 +1,112 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+
+from matp import mat
+from matp.test import bench
+from matp.test.test_mat import TimerTestCase, convert
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+class EnginesTestCase(TimerTestCase):
+    '''Every engine should give exactly the output of the sequential parse_file'''
+    def setUp(self):
+        super(EnginesTestCase, self).setUp()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        super(EnginesTestCase, self).tearDown()
+
+    def test_samples(self):
+        '''the output of every sample should also be the committed one'''
+        results, problems = bench.run(bench.sample_lids(), repeat=1)
+        self.assertEqual(problems, [])
+        self.assertEqual(len(results), len(bench.sample_lids()))
+        checksums = bench.load_checksums()
+        self.assertTrue(set(results) <= set(checksums))
+        self.assertEqual(bench.check_checksums(results, checksums), [])
+
+    def test_synthetic(self):
+        lid = os.path.join(self.dir, 's5_5-10-64-320_x%d.lid' % bench.DEFAULT_PAGES)
+        bench.make_synthetic_lid(bench.sample_lids()[-1], lid, bench.DEFAULT_PAGES)
+        self.assertEqual(mat.count_data_pages(lid), bench.DEFAULT_PAGES)
+        results, problems = bench.run([lid], repeat=1)
+        self.assertEqual(problems + bench.check_checksums(results, bench.load_checksums()), [])
+
+class CompareTestCase(TimerTestCase):
+    def setUp(self):
+        super(CompareTestCase, self).setUp()
+        self.baseline = {'a.lid': {'sha256': 'abc',
+                                   'seconds': {'sequential': 1.0, 'workers': 0.01},
+                                   'mb_per_second': {'sequential': 2.0, 'workers': 200.0}}}
+
+    def result(self, sha256='abc', speed=2.0):
+        return {'a.lid': {'sha256': sha256, 'seconds': {},
+                          'mb_per_second': {'sequential': speed, 'workers': 1.0}}}
+
+    def test_same(self):
+        '''too short timings should not be compared'''
+        self.assertEqual(bench.compare(self.result(speed=1.9), self.baseline), [])
+
+    def test_slower(self):
+        problems = bench.compare(self.result(speed=1.0), self.baseline, threshold=0.25)
+        self.assertEqual(len(problems), 1)
+        self.assertIn('sequential got 50% slower', problems[0])
+
+    def test_changed_output(self):
+        '''checksums are checked on their own, not against the timings'''
+        self.assertEqual(bench.compare(self.result(sha256='def'), self.baseline), [])
+        self.assertEqual(len(bench.check_checksums(self.result(sha256='def'),
+                                                   {'a.lid': 'abc'})), 1)
+        self.assertEqual(bench.check_checksums(self.result(), {'a.lid': 'abc'}), [])
+
+@unittest.skipIf(pandas is None, 'pandas is not installed')
+class CompareFrameTestCase(TimerTestCase):
+    '''The csv output should have the numbers read_lid decodes on its own'''
+    def setUp(self):
+        super(CompareFrameTestCase, self).setUp()
+        self.lid = bench.sample_lids()[-1]
+        self.ori, self.tmp = convert(self.lid)
+
+    def changed(self, text, row, column, change):
+        lines = text.split(os.linesep)
+        values = lines[row].split(',')
+        values[column] = change(values[column])
+        lines[row] = ','.join(values)
+        return os.linesep.join(lines)
+
+    def test_same(self):
+        self.assertEqual(bench.compare_frame(self.lid, (self.ori, self.tmp)), [])
+
+    def test_changed_value(self):
+        tmp = self.changed(self.tmp, 1, 2, lambda v: '%.4f' % (float(v) + 0.0001))
+        self.assertEqual(bench.compare_frame(self.lid, (self.ori, tmp)),
+                         ['s5_5-10-64-320.lid: 1 Temperature (C) values differ from read_lid'])
+        ori = self.changed(self.ori, 3, 7, lambda v: '%.2f' % (float(v) + 0.01))
+        self.assertEqual(bench.compare_frame(self.lid, (ori, self.tmp)),
+                         ['s5_5-10-64-320.lid: 1 Mz (mG) values differ from read_lid'])
+
+    def test_changed_time(self):
+        tmp = self.changed(self.tmp, 2, 1, lambda v: v.replace('.0000', '.0100'))
+        self.assertEqual(bench.compare_frame(self.lid, (self.ori, tmp)),
+                         ['s5_5-10-64-320.lid: 1 Temperature (C) times differ from read_lid'])
+
+    def test_missing_row(self):
+        tmp = os.linesep.join(self.tmp.split(os.linesep)[:-2] + [''])
+        self.assertEqual(len(bench.compare_frame(self.lid, (self.ori, tmp))), 1)
+
+@unittest.skipUnless(os.path.exists(bench.DEFAULT_BASELINE),
+                     'no timing baseline, record one with python -m matp.test.bench --record')
+class ThroughputTestCase(TimerTestCase):
+    def test_throughput(self):
+        '''nothing should be slower than the recorded baseline'''
+        with open(bench.DEFAULT_BASELINE) as fh:
+            baseline = json.load(fh)
+        results, problems = bench.bench()
+        self.assertEqual(problems + bench.compare(results, baseline), [])
@@ -0,0 +1,69 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from matp import segments
+from matp.test import bench
+from matp.test.test_mat import TimerTestCase, SAMPLES_DIR, convert
+
+LID = os.path.join(SAMPLES_DIR, 'sample5', 's5_5-10-64-320.lid')
+
+class ConvertFileTestCase(TimerTestCase):
+    def setUp(self):
+        super(ConvertFileTestCase, self).setUp()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        super(ConvertFileTestCase, self).tearDown()
+
+    def convert(self, lid_filename, **kwargs):
+        filenames = [os.path.join(self.dir, name) for name in ('ori.csv', 'tmp.csv')]
+        segments.convert_file(lid_filename, *filenames, workers=2, **kwargs)
+        output = []
+        for filename in filenames:
+            with open(filename, newline='') as fh:
+                output.append(fh.read())
+        return tuple(output)
+
+    def test_sample(self):
+        '''the csv files should be the ones parse_file writes'''
+        self.assertEqual(self.convert(LID), convert(LID))
+
+    def test_many_segments(self):
+        '''segments finishing out of order should still be joined in page order'''
+        lid = os.path.join(self.dir, 'synthetic.lid')
+        bench.make_synthetic_lid(LID, lid, 5)
+        for segment_pages in (1, 2, 16):
+            self.assertEqual(self.convert(lid, segment_pages=segment_pages), convert(lid))
+
+    def test_only(self):
+        self.assertEqual(self.convert(LID, only='temp')[1], convert(LID, only='temp')[1])
+        self.assertEqual(self.convert(LID, only='ori')[0], convert(LID, only='ori')[0])
+
+    def test_segment_files_removed(self):
+        self.convert(LID, segment_pages=1)
+        self.assertEqual(sorted(os.listdir(self.dir)), ['ori.csv', 'tmp.csv'])
+
+class AppendFileTestCase(TimerTestCase):
+    def test_append(self):
+        directory = tempfile.mkdtemp()
+        try:
+            src = os.path.join(directory, 'src')
+            dst = os.path.join(directory, 'dst')
+            with open(src, 'wb') as fh:
+                fh.write(b'segment' * 100000)
+            with open(dst, 'wb') as fh:
+                fh.write(b'header')
+                segments.append_file(src, fh)
+                segments.append_file(src, fh)
+                fh.write(b'end')
+            with open(dst, 'rb') as fh:
+                self.assertEqual(fh.read(), b'header' + b'segment' * 200000 + b'end')
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import threading
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from matp import mat
+from matp import server
+from matp.test.test_mat import TimerTestCase, SAMPLES_DIR, convert
+
+LID = os.path.join(SAMPLES_DIR, 'sample5', 's5_5-10-64-320.lid')
+
+class ConverterServerTestCase(TimerTestCase):
+    workers = 0
+
+    def setUp(self):
+        super(ConverterServerTestCase, self).setUp()
+        self.server = server.ConverterServer(('127.0.0.1', 0), workers=self.workers, max_jobs=1)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(ConverterServerTestCase, self).tearDown()
+
+    def get(self, url_path, **query):
+        url = 'http://127.0.0.1:%d%s' % (self.server.server_address[1], url_path)
+        if query:
+            url += '?' + urlencode(query)
+        with urlopen(url) as response:
+            return response.read().decode('ascii')
+
+    def test_convert(self):
+        '''the streamed csv should be the one parse_file writes'''
+        ori, tmp = convert(LID)
+        self.assertEqual(self.get('/convert', path=LID, csv='tmp'), tmp)
+        self.assertEqual(self.get('/convert', path=LID, csv='ori'), ori)
+
+    def test_concurrent_jobs(self):
+        '''jobs waiting for their turn should still all be converted'''
+        ori, tmp = convert(LID)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.get('/convert', path=LID, csv='tmp'))) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [tmp] * 3)
+
+    def test_jobs(self):
+        '''finished jobs should be reported with their throughput'''
+        self.get('/convert', path=LID, csv='tmp')
+        jobs = json.loads(self.get('/jobs'))
+        self.assertEqual(jobs['running'], [])
+        job, = jobs['finished']
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['path'], LID)
+        self.assertEqual(job['pages'], 1)
+        self.assertEqual(job['input_bytes'], os.path.getsize(LID))
+        self.assertGreater(job['pages_per_second'], 0)
+
+    def test_errors(self):
+        not_lid = os.path.join(tempfile.mkdtemp(), 'not.lid')
+        self.addCleanup(shutil.rmtree, os.path.dirname(not_lid))
+        with open(not_lid, 'wb') as fh:
+            fh.write(b'not a lid file' * 5000)
+        for url_path, query, status in (('/convert', {'path': LID, 'csv': 'xyz'}, 400),
+                                        ('/convert', {'path': not_lid, 'csv': 'tmp'}, 400),
+                                        ('/convert', {}, 400),
+                                        ('/convert', {'path': LID + '.missing'}, 404),
+                                        ('/nothing', {}, 404)):
+            with self.assertRaises(HTTPError) as raised:
+                self.get(url_path, **query)
+            self.assertEqual(raised.exception.code, status)
+
+class ServeArgumentsTestCase(TimerTestCase):
+    def test_max_jobs(self):
+        '''a server without job slots would never convert anything'''
+        for max_jobs in (0, -1):
+            self.assertRaises(ValueError, server.ConverterServer, ('127.0.0.1', 0),
+                              max_jobs=max_jobs)
+            self.assertRaises(ValueError, mat.positive_int, str(max_jobs))
+
+    def test_port(self):
+        self.assertEqual(mat.port_number('0'), 0)
+        self.assertEqual(mat.port_number('65535'), 65535)
+        for port in ('-1', '65536', 'http'):
+            self.assertRaises(ValueError, mat.port_number, port)
+
+class ConverterServerPoolTestCase(ConverterServerTestCase):
+    workers = 2
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import os
+import math
+from io import StringIO
+
+from matp import summary
+from matp.test.test_mat import TimerTestCase, SAMPLES_DIR, convert
+
+class ParseIntervalTestCase(TimerTestCase):
+    def test_names(self):
+        self.assertEqual(summary.parse_interval('hour'), 3600)
+        self.assertEqual(summary.parse_interval('Day'), 86400)
+
+    def test_units(self):
+        self.assertEqual(summary.parse_interval('90'), 90)
+        self.assertEqual(summary.parse_interval('15m'), 900)
+        self.assertEqual(summary.parse_interval('2h'), 7200)
+
+    def test_invalid(self):
+        for text in ('', '0', 'fortnight', '-5', '1.5h'):
+            self.assertRaises(ValueError, summary.parse_interval, text)
+
+class RunningStatsTestCase(TimerTestCase):
+    def test_batches(self):
+        '''adding values in batches should give the same stats as all at once'''
+        values = [3.5, -1.0, 2.25, 8.0, 0.0, 4.75, -3.5]
+        stats = summary.RunningStats()
+        stats.update(values[:2])
+        stats.update([])
+        stats.update(values[2:3])
+        stats.update(values[3:])
+        mean = sum(values) / len(values)
+        std = math.sqrt(sum((v - mean) ** 2 for v in values) / (len(values) - 1))
+        self.assertEqual(stats.count, len(values))
+        self.assertAlmostEqual(stats.mean, mean)
+        self.assertAlmostEqual(stats.std(), std)
+        self.assertEqual(stats.min, -3.5)
+        self.assertEqual(stats.max, 8.0)
+
+    def test_single_value(self):
+        stats = summary.RunningStats()
+        stats.update([1.5])
+        self.assertEqual(stats.mean, 1.5)
+        self.assertIsNone(stats.std())
+
+class SummarizeFileTestCase(TimerTestCase):
+    def setUp(self):
+        super(SummarizeFileTestCase, self).setUp()
+        self.lid = os.path.join(SAMPLES_DIR, 'sample5', 's5_5-10-64-320.lid')
+
+    def test_counts_match_csv(self):
+        '''every row of the csv files should be counted once per sensor'''
+        ori, tmp = convert(self.lid)
+        counts = {}
+        for start, (name, precision), stats in summary.summarize_file(self.lid, 3600):
+            counts[name] = counts.get(name, 0) + stats.count
+        self.assertEqual(counts['Temperature (C)'], len(tmp.splitlines()) - 1)
+        self.assertEqual(counts['Ax (g)'], len(ori.splitlines()) - 1)
+        self.assertEqual(counts['Mz (mG)'], len(ori.splitlines()) - 1)
+
+    def test_intervals_in_order(self):
+        starts = [start for start, sensor, stats in summary.summarize_file(self.lid, 60)]
+        self.assertEqual(starts, sorted(starts))
+        for start in starts:
+            self.assertEqual(start.second, 0)
+
+    def test_write_summary(self):
+        fh = StringIO()
+        summary.write_summary(summary.summarize_file(self.lid, 86400), fh)
+        lines = fh.getvalue().split(os.linesep)
+        self.assertEqual(lines[0], summary.SUMMARY_CSV_HEADER)
+        self.assertTrue(lines[1].startswith('2013-11-15,00:00:00,Temperature (C),164,'))
+        self.assertEqual(len(lines), 2 + 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import unittest
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from matp import mat
+from matp import validate
+from matp.test.test_mat import TimerTestCase, SAMPLES_DIR
+
+SAMPLE = os.path.join(SAMPLES_DIR, 'sample5', 's5_5-10-64-320.lid')
+
+class ValidateFileTestCase(TimerTestCase):
+    def setUp(self):
+        super(ValidateFileTestCase, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        with open(SAMPLE, 'rb') as fh:
+            self.sample = fh.read()
+        header, mini_header, hss, self.mh_size = mat.parse_main_header(
+            self.sample[:mat.MAIN_HEADER_SIZE])
+        self.layout = mat.get_page_layout(mini_header)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        super(ValidateFileTestCase, self).tearDown()
+
+    def make_lid(self, clks, change=None):
+        '''Write a lid file with one data page per clk made out of the sample data.
+
+        change(page_number, page) can return a modified page.
+        '''
+        header = self.sample[:mat.MAIN_HEADER_SIZE]
+        first_page = self.sample[mat.MAIN_HEADER_SIZE:]
+        data = first_page[self.mh_size:]
+        filename = os.path.join(self.dir, 'test.lid')
+        with open(filename, 'wb') as fh:
+            fh.write(header)
+            for page_number, clk in enumerate(clks):
+                clk_start = first_page.find(b'CLK ') + 4
+                page = first_page[:clk_start] + clk.encode('ascii') + first_page[clk_start + len(clk):self.mh_size]
+                if page_number < len(clks) - 1:
+                    # Only the last page is partially written
+                    page += (data * 4)[:mat.DATA_PAGE_SIZE - self.mh_size]
+                else:
+                    page += data
+                if change:
+                    page = change(page_number, page)
+                fh.write(page)
+        return filename
+
+    def problems(self, filename):
+        return [report.problems for report in validate.validate_file(filename)]
+
+    def test_samples(self):
+        '''the samples have no problems'''
+        for directory in os.listdir(SAMPLES_DIR):
+            for name in os.listdir(os.path.join(SAMPLES_DIR, directory)):
+                if name.endswith('.lid'):
+                    filename = os.path.join(SAMPLES_DIR, directory, name)
+                    self.assertEqual(self.problems(filename), [[]])
+
+    def test_crc32(self):
+        report, = validate.validate_file(SAMPLE)
+        self.assertEqual(report.crc32, 0xb9848440)
+        self.assertEqual(report.offset, mat.MAIN_HEADER_SIZE)
+
+    def test_erased_end(self):
+        '''an erased end of the last page is where the data stops'''
+        filename = self.make_lid(['2013-11-15 09:04:12'],
+                                 change=lambda n, page: page + b'\xff' * 1000)
+        self.assertEqual(self.problems(filename), [[]])
+
+    def test_ff_run(self):
+        def erase(page_number, page):
+            if page_number == 0:
+                return page[:5000] + b'\xff' * 20 + page[5020:]
+            return page
+        filename = self.make_lid(['2013-11-15 09:04:12', '2013-11-15 10:04:12'], change=erase)
+        offset = mat.MAIN_HEADER_SIZE + 5000
+        self.assertEqual(self.problems(filename),
+                         [['20 bytes of 0xFF at byte %d' % offset], []])
+
+    def test_clock_goes_back(self):
+        filename = self.make_lid(['2013-11-15 09:04:12', '2013-11-15 08:04:12',
+                                  '2013-11-15 10:04:12'])
+        problems = self.problems(filename)
+        self.assertEqual(len(problems[1]), 1)
+        self.assertIn('is not after', problems[1][0])
+        self.assertEqual(problems[2], [])
+
+    def test_broken_mini_header(self):
+        filename = self.make_lid(['2013-11-15 09:04:12', '2013-13-15 09:04:12',
+                                  '2013-11-15 10:04:12'],
+                                 change=lambda n, page: b'XYZ' + page[3:] if n == 2 else page)
+        self.assertEqual(self.problems(filename), [
+            [],
+            ["CLK '2013-13-15 09:04:12' can not be parsed"],
+            ['mini header does not start with MHS'],
+        ])
+
+    def test_invalid_temperatures(self):
+        p_size = self.layout.p_size
+        def zero_temperatures(page_number, page):
+            # First word of the second and third pattern
+            for start in (self.mh_size + p_size, self.mh_size + 2 * p_size):
+                page = page[:start] + b'\x00\x00' + page[start + 2:]
+            # Last word of the fourth pattern, a temperature since TRI < ORI
+            end = self.mh_size + 4 * p_size
+            return page[:end - 2] + b'\xff\xff' + page[end:]
+        filename = self.make_lid(['2013-11-15 09:04:12'], change=zero_temperatures)
+        self.assertEqual(self.problems(filename), [['3 temperature readings are 0 or 0xFFFF']])
+
+    def test_no_mini_header(self):
+        filename = os.path.join(self.dir, 'empty.lid')
+        with open(filename, 'wb') as fh:
+            fh.write(b'\xff' * mat.MAIN_HEADER_SIZE)
+        report, = validate.validate_file(filename)
+        self.assertIsNone(report.page_number)
+        self.assertEqual(report.problems, ['main header has no MHS', 'main header has no MHE'])
+
+    def corrupt_header(self, old, new):
+        '''Write the sample with old replaced by new in the main header, return its report'''
+        header = self.sample[:mat.MAIN_HEADER_SIZE]
+        self.assertIn(old, header)
+        filename = os.path.join(self.dir, 'corrupt.lid')
+        with open(filename, 'wb') as fh:
+            fh.write(header.replace(old, new, 1) + self.sample[mat.MAIN_HEADER_SIZE:])
+        report, = validate.validate_file(filename)
+        self.assertIsNone(report.page_number)
+        return report
+
+    def test_corrupt_hss(self):
+        '''a bad length in the HSS should be reported, not raised'''
+        report = self.corrupt_header(b'TMR510000', b'TMRx10000')
+        problem, = report.problems
+        self.assertTrue(problem.startswith('main header or HSS can not be parsed: '))
+
+    def test_corrupt_mini_header_value(self):
+        report = self.corrupt_header(b'BMN 320', b'BMN x20')
+        problem, = report.problems
+        self.assertTrue(problem.startswith('mini header in the main header can not be parsed: '))
+
+    def test_write_report(self):
+        filename = self.make_lid(['2013-11-15 09:04:12', '2013-11-15 08:04:12'])
+        fh = StringIO()
+        self.assertEqual(validate.write_report(validate.validate_file(filename), fh), 1)
+        lines = fh.getvalue().split(os.linesep)
+        self.assertTrue(lines[0].startswith('page 0 offset 32768 crc32 '))
+        self.assertTrue(lines[0].endswith(' OK'))
+        self.assertTrue(lines[1].endswith(' 1 problems'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+'''Check a lid file for corrupted or partially erased data pages without converting it.
+
+Every check works on whole pages at once (regular expressions, strided array
+slices and counts) so a file can be checked at close to the speed it is read.
+'''
+from __future__ import division
+import array
+import collections
+import datetime
+import os
+import re
+import struct
+import sys
+import zlib
+
+from matp import mat
+
+# Erased flash reads as 0xFF, this many of them in a row is not data any more.
+# Same length the page parser uses to find the end of the data.
+FF_RUN_LENGTH = 14
+FF_RUN = re.compile(b'\xff{%d,}' % FF_RUN_LENGTH)
+
+MINI_HEADER_START = b'MHS' + mat.HEADER_SEPARATOR
+MINI_HEADER_END = b'MHE' + mat.HEADER_SEPARATOR
+REQUIRED_MINI_HEADER_TAGS = ('CLK', 'TMP', 'ACL', 'MGN', 'TRI', 'ORI', 'BMR', 'BMN')
+
+# Temperature readings that can not come from the thermometer
+INVALID_TEMPERATURES = (0, mat.MAX_UNSIGNED_SHORT)
+
+PageReport = collections.namedtuple('PageReport', [
+    'page_number', 'offset', 'crc32', 'clk', 'problems',
+])
+
+def find_ff_runs(data):
+    '''Return (start, length) of every run of at least FF_RUN_LENGTH 0xFF bytes'''
+    return [(m.start(), m.end() - m.start()) for m in FF_RUN.finditer(data)]
+
+def check_main_header(header_bytes):
+    '''Return a list of problems with the main header, empty if it can be parsed'''
+    problems = []
+    for tag in (b'MHS', b'MHE'):
+        if header_bytes.find(tag) == -1:
+            problems.append('main header has no %s' % tag.decode('ascii'))
+    if problems:
+        return problems
+    try:
+        header, mini_header, hss, mh_size = mat.parse_main_header(header_bytes)
+    except (ValueError, KeyError, struct.error) as e:
+        return ['main header or HSS can not be parsed: %s' % e]
+    missing = [tag for tag in REQUIRED_MINI_HEADER_TAGS if tag not in mini_header]
+    if missing:
+        problems.append('mini header in the main header has no %s' % ', '.join(missing))
+        return problems
+    try:
+        mat.get_page_layout(mini_header)
+    except (ValueError, KeyError, ZeroDivisionError, struct.error) as e:
+        problems.append('mini header in the main header can not be parsed: %s' % e)
+    return problems
+
+def check_mini_header(data_page, mh_size):
+    '''Return (clk, problems) for the mini header at the start of a data page'''
+    mh_bytes = data_page[:mh_size]
+    if not mh_bytes.startswith(MINI_HEADER_START):
+        return None, ['mini header does not start with MHS']
+    if not mh_bytes.endswith(MINI_HEADER_END):
+        return None, ['mini header does not end with MHE after %d bytes' % mh_size]
+    mh = mat.parse_header(mh_bytes)
+    if 'CLK' not in mh:
+        return None, ['mini header has no CLK']
+    try:
+        return datetime.datetime.strptime(mh['CLK'], mat.CLOCK_FORMAT), []
+    except ValueError:
+        return None, ['CLK %r can not be parsed' % mh['CLK']]
+
+def count_invalid_temperatures(data, layout):
+    '''Return how many temperature words in the complete patterns of data are invalid'''
+    if not layout.tmp:
+        return 0
+    words = array.array('H')
+    words.frombytes(data[:len(data) - len(data) % 2])
+    if sys.byteorder == 'big':
+        words.byteswap()
+    pattern_words = layout.p_size // 2
+    full = len(words) - len(words) % pattern_words
+    columns, ori_start, ori_stop = mat.pattern_word_positions(layout)
+    count = 0
+    for column in columns:
+        readings = words[column:full:pattern_words]
+        count += sum(readings.count(invalid) for invalid in INVALID_TEMPERATURES)
+    return count
+
+def validate_file(lid_filename):
+    '''Yield a PageReport for every data page of the lid file
+
+    problems is a list of messages, empty when nothing is wrong with the
+    page. Problems with the main header are reported with page_number None,
+    pages are not checked if the main header can not be parsed.
+    '''
+    num_pages = mat.count_data_pages(lid_filename)
+    with open(lid_filename, 'rb') as lid:
+        header_bytes = lid.read(mat.MAIN_HEADER_SIZE)
+        problems = check_main_header(header_bytes)
+        if problems:
+            yield PageReport(None, 0, zlib.crc32(header_bytes), None, problems)
+            return
+        header, mini_header, hss, mh_size = mat.parse_main_header(header_bytes)
+        layout = mat.get_page_layout(mini_header)
+
+        previous_clk = None
+        for page_number, data_page in mat.read_data_pages(lid, num_pages):
+            offset = mat.MAIN_HEADER_SIZE + mat.DATA_PAGE_SIZE * page_number
+            crc32 = zlib.crc32(data_page)
+            clk, problems = check_mini_header(data_page, mh_size)
+            if clk is not None:
+                if previous_clk is not None and clk <= previous_clk:
+                    problems.append('CLK %s is not after the CLK of the page before (%s)'
+                                    % (clk, previous_clk))
+                previous_clk = clk
+
+            data = memoryview(data_page)[mh_size:]
+            runs = find_ff_runs(data)
+            last_page = page_number == num_pages - 1
+            if runs and last_page and sum(runs[-1]) == len(data):
+                # The erased rest of the last page is where the data ends
+                data = data[:runs[-1][0]]
+                runs = runs[:-1]
+            for start, length in runs:
+                problems.append('%d bytes of 0xFF at byte %d' % (length, offset + mh_size + start))
+
+            if clk is not None:
+                invalid = count_invalid_temperatures(data, layout)
+                if invalid:
+                    problems.append('%d temperature readings are 0 or 0xFFFF' % invalid)
+            yield PageReport(page_number, offset, crc32, clk, problems)
+
+def write_report(reports, fh):
+    '''Write one line per page and one per problem. Returns the number of problems'''
+    total = 0
+    for report in reports:
+        page = 'header' if report.page_number is None else 'page %d' % report.page_number
+        fh.write('%s offset %d crc32 %08x %s%s' % (
+            page, report.offset, report.crc32,
+            'OK' if not report.problems else '%d problems' % len(report.problems),
+            os.linesep))
+        for problem in report.problems:
+            fh.write('  %s%s' % (problem, os.linesep))
+        total += len(report.problems)
+    return total